@@ -1,15 +1,23 @@
 # This code is messy, this was originally an experiment
 import asyncio
+import time
+from contextlib import aclosing
 from typing import AsyncIterator
 
 from fastapi import HTTPException
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-
-from backend.chat import rephrase_query_with_history
-from backend.constants import get_model_string
-from backend.db.chat import save_turn_to_db
-from backend.llm.base import BaseLLM, EveryLLM
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.chat import get_stage_llm, rephrase_query_with_history
+from backend.constants import ModelStage, get_model_string
+from backend.context import (
+    CONTEXT_TOKENS_ANSWER,
+    CONTEXT_TOKENS_STEP,
+    pack_search_results,
+)
+from backend.db.writer import save_turn
+from backend.llm.base import BaseLLM, get_llm
+from backend.metrics import record_stage, timed
 from backend.prompts import CHAT_PROMPT, QUERY_PLAN_PROMPT, SEARCH_QUERY_PROMPT
 from backend.related_queries import generate_related_queries
 from backend.schemas import (
@@ -30,9 +38,11 @@ from backend.schemas import (
     SearchResultStream,
     StreamEndStream,
     StreamEvent,
-    TextChunkStream,
 )
+from backend.search.fusion import fuse_search_results
+from backend.search.rerank import rerank_search_results
 from backend.search.search_service import perform_search
+from backend.streaming import TaskScope, text_chunk_event
 from backend.utils import PRO_MODE_ENABLED, is_local_model
 
 
@@ -283,222 +293,375 @@ async def ranked_search_results_and_images_from_queries(
     all_search_results = [response.results for response in search_responses]
     all_images = [response.images for response in search_responses]
 
-    # interleave the search results, for fair ranking
-    ranked_results: list[SearchResult] = [
-        result for results in zip(*all_search_results) for result in results if result
-    ]
-    unique_results = list({result.url: result for result in ranked_results}.values())
+    unique_results = fuse_search_results(all_search_results)
 
     images = list({image: image for images in all_images for image in images}.values())
     return unique_results, images
 
 
-def build_context_from_search_results(search_results: list[SearchResult]) -> str:
-    context = "\n".join(str(result) for result in search_results)
-    return context[:7000]
+def build_context_from_search_results(
+    search_results: list[SearchResult], model: str, tokens: int = CONTEXT_TOKENS_STEP
+) -> str:
+    return "\n".join(
+        str(result) for result in pack_search_results(search_results, model, tokens)
+    )
 
 
 def format_context_with_steps(
     search_results_map: dict[int, list[SearchResult]],
     step_contexts: dict[int, StepContext],
+    model: str,
 ) -> str:
+    # The answer budget is split evenly between the steps
+    tokens = CONTEXT_TOKENS_ANSWER // max(len(step_contexts), 1)
     context = "\n".join(
-        f"Everything below is context for step: {step_contexts[step_id].step}\nContext: {build_context_from_search_results(search_results_map[step_id])}\n{'-'*20}\n"
+        f"Everything below is context for step: {step_contexts[step_id].step}\nContext: {build_context_from_search_results(search_results_map[step_id], model, tokens)}\n{'-'*20}\n"
         for step_id in sorted(step_contexts.keys())
     )
-    context = context[:10000]
     return context
 
 
+def renumber_query_plan(steps: list[QueryPlanStep]) -> list[QueryPlanStep]:
+    """Number the steps of a query plan by position, so every id is unique.
+
+    Models sometimes repeat a step id. A dependency on a repeated id points at
+    the latest step with that id before the dependent step, or the first one
+    if none comes before it. Dependencies on unknown ids are dropped.
+    """
+    positions: dict[int, list[int]] = {}
+    for position, step in enumerate(steps):
+        positions.setdefault(step.id, []).append(position)
+
+    renumbered = []
+    for position, step in enumerate(steps):
+        dependencies = []
+        for dep in step.dependencies:
+            if dep not in positions:
+                continue
+            earlier = [p for p in positions[dep] if p < position]
+            dependencies.append(earlier[-1] if earlier else positions[dep][0])
+        renumbered.append(
+            step.model_copy(update={"id": position, "dependencies": dependencies})
+        )
+    return renumbered
+
+
+def prepare_query_plan(query: str, steps: list[QueryPlanStep]) -> list[QueryPlanStep]:
+    """Renumber a query plan and make sure its answer step has results to use.
+
+    A plan with no search steps, like the one-step plan a malformed plan falls
+    back to, gets a step that searches the question itself. An answer step
+    without dependencies on search steps depends on all of them.
+    """
+    *search_steps, answer_step = renumber_query_plan(steps) or [
+        QueryPlanStep(id=0, step="Answer the question", dependencies=[])
+    ]
+    if not search_steps:
+        search_steps = [QueryPlanStep(id=0, step=query, dependencies=[])]
+        answer_step = answer_step.model_copy(update={"id": 1})
+
+    search_step_ids = [step.id for step in search_steps]
+    dependencies = [dep for dep in answer_step.dependencies if dep in search_step_ids]
+    answer_step = answer_step.model_copy(
+        update={"dependencies": dependencies or search_step_ids}
+    )
+    return [*search_steps, answer_step]
+
+
+def schedule_query_plan(steps: list[QueryPlanStep]) -> dict[int, list[int]]:
+    """Topologically order the search steps of a query plan.
+
+    Returns a mapping of step id to the dependencies the step has to wait for,
+    in an order where every step comes after its dependencies. Dependencies on
+    unknown steps or on the step itself are dropped, and cycles are broken by
+    releasing the earliest remaining step in plan order.
+    """
+    step_ids = {step.id for step in steps}
+    remaining = {
+        step.id: [
+            dep
+            for dep in dict.fromkeys(step.dependencies)
+            if dep in step_ids and dep != step.id
+        ]
+        for step in steps
+    }
+
+    ordered: dict[int, list[int]] = {}
+    while remaining:
+        ready = [
+            step_id
+            for step_id, deps in remaining.items()
+            if all(dep in ordered for dep in deps)
+        ]
+        if not ready:
+            step_id = next(iter(remaining))
+            remaining[step_id] = [dep for dep in remaining[step_id] if dep in ordered]
+            ready = [step_id]
+        for step_id in ready:
+            ordered[step_id] = remaining.pop(step_id)
+    return ordered
+
+
+async def generate_step_search_queries(
+    query: str, step: QueryPlanStep, relevant_context: list[StepContext], llm: BaseLLM
+) -> list[str]:
+    search_prompt = SEARCH_QUERY_PROMPT.format(
+        user_query=query,
+        current_step=step.step,
+        prev_steps_context=format_step_context(relevant_context),
+    )
+    try:
+        with timed("step_queries"):
+            query_step_execution = await llm.astructured_complete(
+                response_model=QueryStepExecution, prompt=search_prompt
+            )
+        search_queries = query_step_execution.search_queries
+        if not search_queries:
+            raise HTTPException(
+                status_code=500,
+                detail="There was an error generating the search queries",
+            )
+    except Exception as e:
+        print(f"Error in astructured_complete for query step: {str(e)}")
+        search_queries = [f"Search for information about: {step.step}"]
+    return search_queries
+
+
+async def stream_search_steps(
+    query: str,
+    steps: list[QueryPlanStep],
+    llm: BaseLLM,
+    step_context: dict[int, StepContext],
+    search_result_map: dict[int, list[SearchResult]],
+    image_map: dict[int, list[str]],
+    query_map: dict[int, list[str]],
+) -> AsyncIterator[ChatResponseEvent]:
+    """Run the search steps of a query plan, independent steps concurrently.
+
+    Each step starts as soon as all of its dependencies have finished. Events
+    are yielded in the order the steps produce them, and the results of every
+    step are written into the given maps keyed by step id.
+    """
+    dependencies = schedule_query_plan(steps)
+    steps_by_id = {step.id: step for step in steps}
+    finished = {step_id: asyncio.Event() for step_id in dependencies}
+    events: asyncio.Queue[ChatResponseEvent | None] = asyncio.Queue()
+
+    async def run_step(step_id: int):
+        for dep in dependencies[step_id]:
+            await finished[dep].wait()
+
+        step = steps_by_id[step_id]
+        relevant_context = [step_context[dep] for dep in dependencies[step_id]]
+        search_queries = await generate_step_search_queries(
+            query, step, relevant_context, llm
+        )
+        query_map[step_id] = search_queries
+
+        events.put_nowait(
+            ChatResponseEvent(
+                event=StreamEvent.AGENT_SEARCH_QUERIES,
+                data=AgentSearchQueriesStream(
+                    queries=search_queries, step_number=step_id
+                ),
+            )
+        )
+
+        with timed("step_search"):
+            (
+                search_results,
+                image_results,
+            ) = await ranked_search_results_and_images_from_queries(search_queries)
+        # Most relevant first, so the step's context budget goes to them
+        search_results = rerank_search_results(
+            " ".join([step.step, *search_queries]), search_results, top_k=None
+        )
+        search_result_map[step_id] = search_results
+        image_map[step_id] = image_results
+
+        events.put_nowait(
+            ChatResponseEvent(
+                event=StreamEvent.AGENT_READ_RESULTS,
+                data=AgentReadResultsStream(
+                    results=search_results, step_number=step_id
+                ),
+            )
+        )
+        context = build_context_from_search_results(search_results, llm.model)
+        step_context[step_id] = StepContext(step=step.step, context=context)
+        finished[step_id].set()
+
+    async def run_all_steps():
+        try:
+            async with asyncio.TaskGroup() as group:
+                for step_id in dependencies:
+                    group.create_task(run_step(step_id))
+        except ExceptionGroup as e:
+            raise e.exceptions[0]
+        finally:
+            events.put_nowait(None)
+
+    async with TaskScope() as scope:
+        runner = scope.create_task(run_all_steps(), name="search_steps")
+        while (event := await events.get()) is not None:
+            yield event
+        await runner
+
+
 async def stream_pro_search_objects(
-    request: ChatRequest, llm: BaseLLM, query: str, session: Session
+    request: ChatRequest, llm: BaseLLM, query: str, session: AsyncSession
 ) -> AsyncIterator[ChatResponseEvent]:
+    related_llm = get_stage_llm(ModelStage.RELATED_QUERIES, request.model, llm)
+    scope = TaskScope()
     try:
         query_plan_prompt = QUERY_PLAN_PROMPT.format(query=query)
-        query_plan = llm.structured_complete(
-            response_model=QueryPlan, prompt=query_plan_prompt
-        )
+        plan_llm = get_stage_llm(ModelStage.QUERY_PLAN, request.model, llm)
+        with timed("query_plan"):
+            query_plan = await plan_llm.astructured_complete(
+                response_model=QueryPlan, prompt=query_plan_prompt
+            )
         print(query_plan)
+        steps = prepare_query_plan(query, query_plan.steps)
 
         yield ChatResponseEvent(
             event=StreamEvent.AGENT_QUERY_PLAN,
-            data=AgentQueryPlanStream(steps=[step.step for step in query_plan.steps]),
+            data=AgentQueryPlanStream(steps=[step.step for step in steps]),
         )
 
         step_context: dict[int, StepContext] = {}
         search_result_map: dict[int, list[SearchResult]] = {}
         image_map: dict[int, list[str]] = {}
-        agent_search_steps: list[AgentSearchStep] = []
+        query_map: dict[int, list[str]] = {}
+
+        # Every step but the last one is a search step, the last one answers
+        *search_steps, final_step = steps
+
+        async for event in stream_search_steps(
+            query,
+            search_steps,
+            get_stage_llm(ModelStage.SEARCH_QUERIES, request.model, llm),
+            step_context,
+            search_result_map,
+            image_map,
+            query_map,
+        ):
+            yield event
 
-        for idx, step in enumerate(query_plan.steps):
-            step_id = step.id
-            is_last_step = idx == len(query_plan.steps) - 1
-            dependencies = step.dependencies
+        agent_search_steps: list[AgentSearchStep] = [
+            AgentSearchStep(
+                step_number=step.id,
+                step=step.step,
+                queries=query_map[step.id],
+                results=search_result_map[step.id],
+                status=AgentSearchStepStatus.DONE,
+            )
+            for step in search_steps
+        ]
 
-            relevant_context = [step_context[id] for id in dependencies]
+        step_id = final_step.id
+        dependencies = final_step.dependencies
 
-            if not is_last_step:
-                search_prompt = SEARCH_QUERY_PROMPT.format(
-                    user_query=query,
-                    current_step=step.step,
-                    prev_steps_context=format_step_context(relevant_context),
-                )
-                try:
-                    query_step_execution = llm.structured_complete(
-                        response_model=QueryStepExecution, prompt=search_prompt
-                    )
-                    search_queries = query_step_execution.search_queries
-                    if not search_queries:
-                        raise HTTPException(
-                            status_code=500,
-                            detail="There was an error generating the search queries",
-                        )
-                except Exception as e:
-                    print(f"Error in structured_complete for query step: {str(e)}")
-                    search_queries = [f"Search for information about: {step.step}"]
-            
-                yield ChatResponseEvent(
-                    event=StreamEvent.AGENT_SEARCH_QUERIES,
-                    data=AgentSearchQueriesStream(
-                        queries=search_queries, step_number=step_id
-                    ),
-                )
-
-                (
-                    search_results,
-                    image_results,
-                ) = await ranked_search_results_and_images_from_queries(search_queries)
-                search_result_map[step_id] = search_results
-                image_map[step_id] = image_results
-
-                yield ChatResponseEvent(
-                    event=StreamEvent.AGENT_READ_RESULTS,
-                    data=AgentReadResultsStream(
-                        results=search_results, step_number=step_id
-                    ),
-                )
-                context = build_context_from_search_results(search_results)
-                step_context[step_id] = StepContext(step=step.step, context=context)
-
-                agent_search_steps.append(
-                    AgentSearchStep(
-                        step_number=step_id,
-                        step=step.step,
-                        queries=search_queries,
-                        results=search_results,
-                        status=AgentSearchStepStatus.DONE,
-                    )
-                )
-            else:
-                yield ChatResponseEvent(
-                    event=StreamEvent.AGENT_FINISH,
-                    data=AgentFinishStream(),
-                )
-
-                yield ChatResponseEvent(
-                    event=StreamEvent.BEGIN_STREAM,
-                    data=BeginStream(query=query),
-                )
-
-                # Get 12 results total, but distribute them evenly across dependencies
-                relevant_result_map: dict[int, list[SearchResult]] = {
-                    id: search_result_map[id] for id in dependencies
-                }
-                DESIRED_RESULT_COUNT = 12
-                total_results = sum(
-                    len(results) for results in relevant_result_map.values()
-                )
-                results_per_dependency = min(
-                    DESIRED_RESULT_COUNT // len(dependencies),
-                    total_results // len(dependencies),
-                )
-                for id in dependencies:
-                    relevant_result_map[id] = search_result_map[id][:results_per_dependency]
-
-                search_results = [
-                    result for results in relevant_result_map.values() for result in results
-                ]
-
-                # Remove duplicates
-                search_results = list(
-                    {result.url: result for result in search_results}.values()
-                )
-                images = [image for id in dependencies for image in image_map[id][:2]]
-
-                related_queries_task = None
-                if not is_local_model(request.model):
-                    related_queries_task = asyncio.create_task(
-                        generate_related_queries(query, search_results, llm)
-                    )
-
-                yield ChatResponseEvent(
-                    event=StreamEvent.SEARCH_RESULTS,
-                    data=SearchResultStream(
-                        results=search_results,
-                        images=images,
-                    ),
-                )
-
-                fmt_qa_prompt = CHAT_PROMPT.format(
-                    my_context=format_context_with_steps(search_result_map, step_context),
-                    my_query=query,
-                )
-
-                full_response = ""
-                response_gen = await llm.astream(fmt_qa_prompt)
-                async for completion in response_gen:
-                    full_response += completion.delta or ""
-                    yield ChatResponseEvent(
-                        event=StreamEvent.TEXT_CHUNK,
-                        data=TextChunkStream(text=completion.delta or ""),
-                    )
-
-                related_queries = await (
-                    related_queries_task
-                    if related_queries_task
-                    else generate_related_queries(query, search_results, llm)
-                )
-
-                yield ChatResponseEvent(
-                    event=StreamEvent.RELATED_QUERIES,
-                    data=RelatedQueriesStream(related_queries=related_queries),
-                )
-
-                yield ChatResponseEvent(
-                    event=StreamEvent.FINAL_RESPONSE,
-                    data=FinalResponseStream(message=full_response),
-                )
-
-                agent_search_steps.append(
-                    AgentSearchStep(
-                        step_number=step_id,
-                        step=step.step,
-                        queries=[],
-                        results=[],
-                        status=AgentSearchStepStatus.DONE,
-                    )
-                )
-
-                thread_id = save_turn_to_db(
-                    session=session,
-                    thread_id=request.thread_id,
-                    user_message=request.query,
-                    assistant_message=full_response,
-                    agent_search_full_response=AgentSearchFullResponse(
-                        steps=[step.step for step in agent_search_steps],
-                        steps_details=agent_search_steps,
-                    ),
-                    model=request.model,
-                    search_results=search_results,
-                    image_results=images,
-                    related_queries=related_queries,
-                )
-
-                yield ChatResponseEvent(
-                    event=StreamEvent.STREAM_END,
-                    data=StreamEndStream(thread_id=thread_id),
-                )
-                return
+        yield ChatResponseEvent(
+            event=StreamEvent.AGENT_FINISH,
+            data=AgentFinishStream(),
+        )
+
+        yield ChatResponseEvent(
+            event=StreamEvent.BEGIN_STREAM,
+            data=BeginStream(query=query),
+        )
+
+        # Rerank the pooled results of the steps the answer depends on
+        DESIRED_RESULT_COUNT = 12
+        search_results = rerank_search_results(
+            query,
+            fuse_search_results(
+                [search_result_map[id] for id in dependencies], top_k=None
+            ),
+            top_k=DESIRED_RESULT_COUNT,
+        )
+        images = [image for id in dependencies for image in image_map[id][:2]]
+
+        related_queries_task = None
+        if not is_local_model(request.model):
+            related_queries_task = scope.create_task(
+                generate_related_queries(query, search_results, related_llm),
+                name="related_queries",
+            )
+
+        yield ChatResponseEvent(
+            event=StreamEvent.SEARCH_RESULTS,
+            data=SearchResultStream(
+                results=search_results,
+                images=images,
+            ),
+        )
+
+        fmt_qa_prompt = CHAT_PROMPT.format(
+            my_context=format_context_with_steps(
+                search_result_map, step_context, llm.model
+            ),
+            my_query=query,
+        )
+
+        response_chunks: list[str] = []
+        answer_start = time.perf_counter()
+        # Closed right away if the stream is abandoned, ending the LLM request
+        async with aclosing(await llm.astream(fmt_qa_prompt)) as response_gen:
+            async for completion in response_gen:
+                delta = completion.delta or ""
+                response_chunks.append(delta)
+                yield text_chunk_event(delta)
+        record_stage("answer", time.perf_counter() - answer_start)
+        full_response = "".join(response_chunks)
+
+        related_queries = await (
+            related_queries_task
+            if related_queries_task
+            else generate_related_queries(query, search_results, related_llm)
+        )
+
+        yield ChatResponseEvent(
+            event=StreamEvent.RELATED_QUERIES,
+            data=RelatedQueriesStream(related_queries=related_queries),
+        )
+
+        yield ChatResponseEvent(
+            event=StreamEvent.FINAL_RESPONSE,
+            data=FinalResponseStream(message=full_response),
+        )
+
+        agent_search_steps.append(
+            AgentSearchStep(
+                step_number=step_id,
+                step=final_step.step,
+                queries=[],
+                results=[],
+                status=AgentSearchStepStatus.DONE,
+            )
+        )
+
+        with timed("save_turn"):
+            thread_id = await save_turn(
+                session=session,
+                thread_id=request.thread_id,
+                user_message=request.query,
+                assistant_message=full_response,
+                agent_search_full_response=AgentSearchFullResponse(
+                    steps=[step.step for step in agent_search_steps],
+                    steps_details=agent_search_steps,
+                ),
+                model=request.model,
+                search_results=search_results,
+                image_results=images,
+                related_queries=related_queries,
+            )
+
+        yield ChatResponseEvent(
+            event=StreamEvent.STREAM_END,
+            data=StreamEndStream(thread_id=thread_id),
+        )
+        return
 
     except Exception as e:
         # If there's any error in the Pro Search, fall back to regular search
@@ -520,21 +683,27 @@ async def stream_pro_search_objects(
         )
         
         fmt_qa_prompt = CHAT_PROMPT.format(
-            my_context=build_context_from_search_results(search_results),
+            my_context=build_context_from_search_results(
+                search_results, llm.model, CONTEXT_TOKENS_ANSWER
+            ),
             my_query=query,
         )
 
-        full_response = ""
-        response_gen = await llm.astream(fmt_qa_prompt)
-        async for completion in response_gen:
-            full_response += completion.delta or ""
-            yield ChatResponseEvent(
-                event=StreamEvent.TEXT_CHUNK,
-                data=TextChunkStream(text=completion.delta or ""),
-            )
+        response_chunks: list[str] = []
+        answer_start = time.perf_counter()
+        # Closed right away if the stream is abandoned, ending the LLM request
+        async with aclosing(await llm.astream(fmt_qa_prompt)) as response_gen:
+            async for completion in response_gen:
+                delta = completion.delta or ""
+                response_chunks.append(delta)
+                yield text_chunk_event(delta)
+        record_stage("answer", time.perf_counter() - answer_start)
+        full_response = "".join(response_chunks)
             
         # Generate related queries
-        related_queries = await generate_related_queries(query, search_results, llm)
+        related_queries = await generate_related_queries(
+            query, search_results, related_llm
+        )
         
         yield ChatResponseEvent(
             event=StreamEvent.RELATED_QUERIES,
@@ -546,26 +715,29 @@ async def stream_pro_search_objects(
             data=FinalResponseStream(message=full_response),
         )
         
-        thread_id = save_turn_to_db(
-            session=session,
-            thread_id=request.thread_id,
-            user_message=request.query,
-            assistant_message=full_response,
-            model=request.model,
-            search_results=search_results,
-            image_results=image_results,
-            related_queries=related_queries,
-        )
+        with timed("save_turn"):
+            thread_id = await save_turn(
+                session=session,
+                thread_id=request.thread_id,
+                user_message=request.query,
+                assistant_message=full_response,
+                model=request.model,
+                search_results=search_results,
+                image_results=image_results,
+                related_queries=related_queries,
+            )
         
         yield ChatResponseEvent(
             event=StreamEvent.STREAM_END,
             data=StreamEndStream(thread_id=thread_id),
         )
         return
+    finally:
+        await scope.aclose()
 
 
 async def stream_pro_search_qa(
-    request: ChatRequest, session: Session
+    request: ChatRequest, session: AsyncSession
 ) -> AsyncIterator[ChatResponseEvent]:
     try:
         if not PRO_MODE_ENABLED:
@@ -575,9 +747,13 @@ async def stream_pro_search_qa(
             )
 
         model_name = get_model_string(request.model)
-        llm = EveryLLM(model=model_name)
+        llm = get_llm(model_name)
 
-        query = rephrase_query_with_history(request.query, request.history, llm)
+        query = await rephrase_query_with_history(
+            request.query,
+            request.history,
+            get_stage_llm(ModelStage.REPHRASE, request.model, llm),
+        )
         async for event in stream_pro_search_objects(request, llm, query, session):
             yield event
             await asyncio.sleep(0)
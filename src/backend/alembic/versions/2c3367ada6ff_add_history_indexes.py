@@ -0,0 +1,53 @@
+"""add history indexes
+
+Revision ID: 2c3367ada6ff
+Revises: d3e38c22f05c
+Create Date: 2026-10-17 12:30:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "2c3367ada6ff"
+down_revision: Union[str, None] = "d3e38c22f05c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Built concurrently so large tables stay writable while indexing
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_chat_thread_time_created_id",
+            "chat_thread",
+            ["time_created", "id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+        op.create_index(
+            "ix_chat_message_chat_thread_id_role_id",
+            "chat_message",
+            ["chat_thread_id", "role", "id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_chat_message_chat_thread_id_role_id",
+            table_name="chat_message",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.drop_index(
+            "ix_chat_thread_time_created_id",
+            table_name="chat_thread",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,84 @@
+"""drop search_result
+
+Revision ID: 5e0c9a7d31b4
+Revises: 8b1f4e6a9c27
+Create Date: 2026-10-17 19:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from backend.utils import canonicalize_url
+
+# revision identifiers, used by Alembic.
+revision: str = "5e0c9a7d31b4"
+down_revision: Union[str, None] = "8b1f4e6a9c27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def link_unlinked_search_results() -> None:
+    """Link search results saved after the sources backfill, e.g. by old workers."""
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.text(
+            "SELECT sr.chat_message_id, sr.title, sr.url, sr.content "
+            "FROM search_result sr WHERE NOT EXISTS ("
+            "SELECT 1 FROM chat_message_source l "
+            "WHERE l.chat_message_id = sr.chat_message_id"
+            ") "
+            "ORDER BY sr.chat_message_id, sr.id"
+        )
+    ).all()
+
+    ranks: dict[int, int] = {}
+    for chat_message_id, title, url, content in rows:
+        source_id = bind.execute(
+            sa.text(
+                "INSERT INTO source (url, title, content) "
+                "VALUES (:url, :title, :content) "
+                "ON CONFLICT (url) DO UPDATE SET url = EXCLUDED.url "
+                "RETURNING id"
+            ),
+            {"url": canonicalize_url(url), "title": title, "content": content},
+        ).scalar_one()
+        rank = ranks.get(chat_message_id, 0)
+        ranks[chat_message_id] = rank + 1
+        bind.execute(
+            sa.text(
+                "INSERT INTO chat_message_source (chat_message_id, rank, source_id) "
+                "VALUES (:chat_message_id, :rank, :source_id)"
+            ),
+            {"chat_message_id": chat_message_id, "rank": rank, "source_id": source_id},
+        )
+
+
+def upgrade() -> None:
+    # Every result is now a source and a link, drop the per-message copies
+    link_unlinked_search_results()
+    op.drop_table("search_result")
+
+
+def downgrade() -> None:
+    op.create_table(
+        "search_result",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("url", sa.String(), nullable=False),
+        sa.Column("content", sa.String(), nullable=False),
+        sa.Column("chat_message_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["chat_message_id"], ["chat_message.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.execute(
+        "INSERT INTO search_result (title, url, content, chat_message_id) "
+        "SELECT s.title, s.url, s.content, l.chat_message_id "
+        "FROM chat_message_source l JOIN source s ON s.id = l.source_id "
+        "ORDER BY l.chat_message_id, l.rank"
+    )
+    op.create_index(
+        "ix_search_result_chat_message_id", "search_result", ["chat_message_id"]
+    )
@@ -0,0 +1,140 @@
+"""normalize sources
+
+Revision ID: 8b1f4e6a9c27
+Revises: 2c3367ada6ff
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from backend.utils import canonicalize_url
+
+# revision identifiers, used by Alembic.
+revision: str = "8b1f4e6a9c27"
+down_revision: Union[str, None] = "2c3367ada6ff"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def backfill_sources() -> None:
+    """Move existing search results onto sources keyed by canonical URL."""
+    bind = op.get_bind()
+    bind.execute(
+        sa.text(
+            "CREATE TEMPORARY TABLE source_url_map "
+            "(url varchar PRIMARY KEY, canonical_url varchar NOT NULL) "
+            "ON COMMIT DROP"
+        )
+    )
+
+    urls = bind.execute(
+        sa.text("SELECT DISTINCT url FROM search_result"),
+        execution_options={"yield_per": BACKFILL_BATCH_SIZE},
+    )
+    for batch in urls.partitions():
+        bind.execute(
+            sa.text(
+                "INSERT INTO source_url_map (url, canonical_url) "
+                "VALUES (:url, :canonical_url)"
+            ),
+            [{"url": url, "canonical_url": canonicalize_url(url)} for (url,) in batch],
+        )
+
+    # The most recently saved title and snippet wins for each URL
+    bind.execute(
+        sa.text(
+            "INSERT INTO source (url, title, content) "
+            "SELECT DISTINCT ON (m.canonical_url) m.canonical_url, sr.title, sr.content "
+            "FROM search_result sr JOIN source_url_map m ON m.url = sr.url "
+            "ORDER BY m.canonical_url, sr.id DESC "
+            "ON CONFLICT (url) DO NOTHING"
+        )
+    )
+    bind.execute(
+        sa.text(
+            "INSERT INTO chat_message_source (chat_message_id, rank, source_id) "
+            "SELECT sr.chat_message_id, "
+            "row_number() OVER (PARTITION BY sr.chat_message_id ORDER BY sr.id) - 1, "
+            "s.id "
+            "FROM search_result sr "
+            "JOIN source_url_map m ON m.url = sr.url "
+            "JOIN source s ON s.url = m.canonical_url"
+        )
+    )
+
+
+def upgrade() -> None:
+    op.create_table(
+        "source",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("url", sa.String(), nullable=False),
+        sa.Column("title", sa.String(), nullable=False),
+        sa.Column("content", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("url"),
+    )
+    op.create_table(
+        "chat_message_source",
+        sa.Column("chat_message_id", sa.Integer(), nullable=False),
+        sa.Column("rank", sa.Integer(), nullable=False),
+        sa.Column("source_id", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["chat_message_id"], ["chat_message.id"]),
+        sa.ForeignKeyConstraint(["source_id"], ["source.id"]),
+        sa.PrimaryKeyConstraint("chat_message_id", "rank"),
+    )
+    backfill_sources()
+    op.create_index(
+        "ix_chat_message_source_source_id", "chat_message_source", ["source_id"]
+    )
+
+    # Responses were saved as JSON strings inside the JSONB column
+    op.execute(
+        "UPDATE chat_message "
+        "SET agent_search_full_response = (agent_search_full_response #>> '{}')::jsonb "
+        "WHERE jsonb_typeof(agent_search_full_response) = 'string'"
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_search_result_chat_message_id",
+            "search_result",
+            ["chat_message_id"],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_search_result_chat_message_id",
+            table_name="search_result",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+
+    op.execute(
+        "UPDATE chat_message "
+        "SET agent_search_full_response = to_jsonb(agent_search_full_response::text) "
+        "WHERE jsonb_typeof(agent_search_full_response) = 'object'"
+    )
+
+    # Messages saved since the upgrade only have links, copy them back
+    op.execute(
+        "INSERT INTO search_result (title, url, content, chat_message_id) "
+        "SELECT s.title, s.url, s.content, l.chat_message_id "
+        "FROM chat_message_source l JOIN source s ON s.id = l.source_id "
+        "WHERE NOT EXISTS ("
+        "SELECT 1 FROM search_result sr WHERE sr.chat_message_id = l.chat_message_id"
+        ") "
+        "ORDER BY l.chat_message_id, l.rank"
+    )
+    op.drop_index("ix_chat_message_source_source_id", table_name="chat_message_source")
+    op.drop_table("chat_message_source")
+    op.drop_table("source")
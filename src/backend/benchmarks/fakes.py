@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import time
+from typing import AsyncIterator
+
+from instructor.client import T
+from pydantic import BaseModel
+
+from backend.agent_search import QueryPlan, QueryPlanStep, QueryStepExecution
+from backend.llm.base import BaseLLM
+from backend.schemas import RelatedQueries, SearchResponse, SearchResult
+from backend.search.providers.base import SearchProvider
+
+
+class FakeSearchProvider(SearchProvider):
+    """Answers every query after a fixed delay with generated results."""
+
+    def __init__(self, latency: float, num_results: int, content_size: int):
+        self.latency = latency
+        self.num_results = num_results
+        self.content_size = content_size
+
+    async def search(self, query: str) -> SearchResponse:
+        await asyncio.sleep(self.latency)
+        results = [
+            SearchResult(
+                title=f"{query} - result {i}",
+                url=f"https://example.com/{abs(hash(query))}/{i}",
+                content=("lorem ipsum " * self.content_size)[: self.content_size],
+            )
+            for i in range(self.num_results)
+        ]
+        images = [f"https://example.com/images/{i}.png" for i in range(4)]
+        return SearchResponse(results=results, images=images)
+
+
+class FakeCompletion(BaseModel):
+    text: str
+    delta: str | None = None
+
+
+class FakeLLM(BaseLLM):
+    """Streams canned tokens with a fixed time to first token and token rate.
+
+    Structured calls take as long as streaming `structured_tokens` tokens, and
+    search queries are numbered so no two requests share a cache entry.
+    """
+
+    def __init__(
+        self,
+        ttft: float,
+        tokens_per_second: float,
+        answer_tokens: int,
+        plan_steps: int,
+        structured_tokens: int = 40,
+    ):
+        self.ttft = ttft
+        self.token_interval = 1 / tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.plan_steps = plan_steps
+        self.structured_tokens = structured_tokens
+        self.query_ids = itertools.count()
+
+    async def generate(self) -> AsyncIterator[FakeCompletion]:
+        await asyncio.sleep(self.ttft)
+        text = ""
+        for i in range(self.answer_tokens):
+            if i:
+                await asyncio.sleep(self.token_interval)
+            delta = f"token{i} " if i % 20 else f"[{i // 20 % 6 + 1}] "
+            text += delta
+            yield FakeCompletion(text=text, delta=delta)
+
+    async def astream(self, prompt: str) -> AsyncIterator[FakeCompletion]:
+        return self.generate()
+
+    @property
+    def structured_latency(self) -> float:
+        return self.ttft + self.structured_tokens * self.token_interval
+
+    def completion(self) -> FakeCompletion:
+        return FakeCompletion(text=f"benchmark question {next(self.query_ids)}")
+
+    def structured_response(self, response_model: type[T]) -> T:
+        if response_model is QueryPlan:
+            search_steps = [
+                QueryPlanStep(id=i, step=f"Research part {i}", dependencies=[])
+                for i in range(self.plan_steps - 1)
+            ]
+            final_step = QueryPlanStep(
+                id=self.plan_steps - 1,
+                step="Answer the question",
+                dependencies=[step.id for step in search_steps],
+            )
+            return QueryPlan(steps=[*search_steps, final_step])
+        if response_model is QueryStepExecution:
+            return QueryStepExecution(
+                search_queries=[
+                    f"benchmark query {next(self.query_ids)}" for _ in range(2)
+                ]
+            )
+        if response_model is RelatedQueries:
+            return RelatedQueries(
+                related_questions=[f"related question {i}" for i in range(3)]
+            )
+        raise NotImplementedError(f"No fake response for {response_model.__name__}")
+
+    def complete(self, prompt: str) -> FakeCompletion:
+        time.sleep(self.structured_latency)
+        return self.completion()
+
+    def structured_complete(self, response_model: type[T], prompt: str) -> T:
+        time.sleep(self.structured_latency)
+        return self.structured_response(response_model)
+
+    async def acomplete(self, prompt: str) -> FakeCompletion:
+        await asyncio.sleep(self.structured_latency)
+        return self.completion()
+
+    async def astructured_complete(self, response_model: type[T], prompt: str) -> T:
+        await asyncio.sleep(self.structured_latency)
+        return self.structured_response(response_model)
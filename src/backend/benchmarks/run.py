@@ -0,0 +1,321 @@
+"""Load test /chat offline against stand-in search and LLM backends.
+
+Starts one or more app workers with `FakeSearchProvider` and `FakeLLM`
+installed, drives concurrent SSE clients in normal and pro-search mode, and
+reports time to first token, total latency, event throughput and per-worker
+CPU and memory. CPU and memory are read from /proc, so they are Linux only.
+
+    cd src && python -m backend.benchmarks.run --concurrency 32 --requests 256
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+
+import httpx
+from pydantic import BaseModel
+
+BENCHMARK_MODEL = "gpt-4o-mini"
+
+
+class BenchmarkConfig(BaseModel):
+    workers: int = 1
+    port: int = 8700
+    concurrency: int = 16
+    requests: int = 128
+    modes: list[str] = ["normal", "pro"]
+
+    search_latency: float = 0.2
+    search_results: int = 6
+    search_content_size: int = 500
+
+    llm_ttft: float = 0.3
+    llm_tokens_per_second: float = 80
+    llm_answer_tokens: int = 300
+    plan_steps: int = 3
+    # Race a second fake provider against the first, as SEARCH_HEDGE_PROVIDER does
+    search_hedge: bool = False
+
+
+class RequestResult(BaseModel):
+    ttft: float | None = None
+    latency: float
+    events: int
+    error: str | None = None
+
+
+class WorkerStats(BaseModel):
+    pid: int
+    cpu_seconds: float
+    cpu_percent: float
+    rss_mb: float
+    peak_rss_mb: float
+
+
+class ModeReport(BaseModel):
+    mode: str
+    requests: int
+    errors: int
+    wall_seconds: float
+    requests_per_second: float
+    events_per_second: float
+    ttft_p50: float | None
+    ttft_p95: float | None
+    ttft_p99: float | None
+    latency_p50: float
+    latency_p95: float
+    latency_p99: float
+    workers: list[WorkerStats]
+
+
+def serve(config: BenchmarkConfig, port: int) -> None:
+    """Run one app worker with the fake backends installed."""
+    # Set before the backend is imported, which reads its config on import
+    os.environ.update(
+        {
+            "DB_ENABLED": "false",
+            "DB_WRITE_BEHIND_ENABLED": "false",
+            "RATE_LIMIT_ENABLED": "false",
+            "REDIS_URL": "",
+            "LOGFIRE_TOKEN": "",
+            "OPENAI_API_KEY": "benchmark",
+            "OPENAI_MODE": "openai",
+            "SEARCH_PROVIDER": "benchmark",
+            "SEARCH_HEDGE_PROVIDER": "benchmark-backup" if config.search_hedge else "",
+        }
+    )
+    import uvicorn
+
+    from backend.benchmarks.fakes import FakeLLM, FakeSearchProvider
+    from backend.constants import ChatModel, get_model_string
+    from backend.llm.base import llm_env_fingerprint, llm_registry
+    from backend.main import app
+    from backend.search.search_service import search_provider_factories
+
+    # Built by the app like a real provider, behind the same guard and hedging
+    for name in ("benchmark", "benchmark-backup"):
+        search_provider_factories[name] = lambda: FakeSearchProvider(
+            latency=config.search_latency,
+            num_results=config.search_results,
+            content_size=config.search_content_size,
+        )
+    llm_registry[get_model_string(ChatModel(BENCHMARK_MODEL))] = (
+        llm_env_fingerprint(),
+        FakeLLM(
+            ttft=config.llm_ttft,
+            tokens_per_second=config.llm_tokens_per_second,
+            answer_tokens=config.llm_answer_tokens,
+            plan_steps=config.plan_steps,
+        ),
+    )
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def read_proc_stats(pid: int) -> tuple[float, float, float]:
+    """CPU seconds, current RSS and peak RSS in MB of a process."""
+    with open(f"/proc/{pid}/stat") as f:
+        # Fields after the command name, which may contain spaces
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    memory = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                memory[key] = int(value.split()[0]) / 1024
+    return cpu_seconds, memory.get("VmRSS", 0.0), memory.get("VmHWM", 0.0)
+
+
+def percentile(values: list[float], p: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+async def wait_until_ready(client: httpx.AsyncClient, url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"Benchmark worker at {url} did not start")
+
+
+async def run_request(
+    client: httpx.AsyncClient, url: str, query: str, pro_search: bool
+) -> RequestResult:
+    payload = {"query": query, "model": BENCHMARK_MODEL, "pro_search": pro_search}
+    start = time.perf_counter()
+    ttft = None
+    events = 0
+    error = None
+    try:
+        async with client.stream("POST", url, json=payload) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                events += 1
+                event = json.loads(line[len("data:") :])
+                if ttft is None and event["event"] == "text-chunk":
+                    ttft = time.perf_counter() - start
+                elif event["event"] == "error":
+                    error = event["data"]["detail"]
+    except httpx.HTTPError as e:
+        error = str(e)
+    return RequestResult(
+        ttft=ttft, latency=time.perf_counter() - start, events=events, error=error
+    )
+
+
+async def run_mode(
+    config: BenchmarkConfig, mode: str, worker_pids: list[int]
+) -> ModeReport:
+    ports = [config.port + i for i in range(config.workers)]
+    request_ids = asyncio.Queue()
+    for i in range(config.requests):
+        request_ids.put_nowait(i)
+    results: list[RequestResult] = []
+
+    async def client_loop(client: httpx.AsyncClient):
+        while not request_ids.empty():
+            i = request_ids.get_nowait()
+            url = f"http://127.0.0.1:{ports[i % len(ports)]}/chat"
+            # Unique queries, so the search cache never answers for the provider
+            query = f"benchmark question {mode} {i}"
+            results.append(await run_request(client, url, query, mode == "pro"))
+
+    limits = httpx.Limits(max_connections=config.concurrency)
+    timeout = httpx.Timeout(300)
+    before = {pid: read_proc_stats(pid)[0] for pid in worker_pids}
+    start = time.perf_counter()
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(config.concurrency)))
+    wall_seconds = time.perf_counter() - start
+
+    workers = []
+    for pid in worker_pids:
+        cpu_seconds, rss_mb, peak_rss_mb = read_proc_stats(pid)
+        cpu_seconds -= before[pid]
+        workers.append(
+            WorkerStats(
+                pid=pid,
+                cpu_seconds=cpu_seconds,
+                cpu_percent=100 * cpu_seconds / wall_seconds,
+                rss_mb=rss_mb,
+                peak_rss_mb=peak_rss_mb,
+            )
+        )
+
+    ttfts = [result.ttft for result in results if result.ttft is not None]
+    latencies = [result.latency for result in results]
+    return ModeReport(
+        mode=mode,
+        requests=len(results),
+        errors=sum(1 for result in results if result.error),
+        wall_seconds=wall_seconds,
+        requests_per_second=len(results) / wall_seconds,
+        events_per_second=sum(result.events for result in results) / wall_seconds,
+        ttft_p50=percentile(ttfts, 50),
+        ttft_p95=percentile(ttfts, 95),
+        ttft_p99=percentile(ttfts, 99),
+        latency_p50=percentile(latencies, 50),
+        latency_p95=percentile(latencies, 95),
+        latency_p99=percentile(latencies, 99),
+        workers=workers,
+    )
+
+
+def format_seconds(value: float | None) -> str:
+    return "-" if value is None else f"{value * 1000:.0f}ms"
+
+
+def print_report(report: ModeReport) -> None:
+    print(
+        f"\n{report.mode}: {report.requests} requests, {report.errors} errors "
+        f"in {report.wall_seconds:.1f}s "
+        f"({report.requests_per_second:.1f} req/s, "
+        f"{report.events_per_second:.0f} events/s)"
+    )
+    print(
+        f"  ttft     p50 {format_seconds(report.ttft_p50)}"
+        f"  p95 {format_seconds(report.ttft_p95)}"
+        f"  p99 {format_seconds(report.ttft_p99)}"
+    )
+    print(
+        f"  latency  p50 {format_seconds(report.latency_p50)}"
+        f"  p95 {format_seconds(report.latency_p95)}"
+        f"  p99 {format_seconds(report.latency_p99)}"
+    )
+    for worker in report.workers:
+        print(
+            f"  worker {worker.pid}: cpu {worker.cpu_seconds:.2f}s "
+            f"({worker.cpu_percent:.0f}%), rss {worker.rss_mb:.0f}MB "
+            f"(peak {worker.peak_rss_mb:.0f}MB)"
+        )
+
+
+async def run_benchmark(config: BenchmarkConfig, worker_pids: list[int]):
+    async with httpx.AsyncClient() as client:
+        for i in range(config.workers):
+            await wait_until_ready(
+                client, f"http://127.0.0.1:{config.port + i}/metrics"
+            )
+    return [await run_mode(config, mode, worker_pids) for mode in config.modes]
+
+
+def parse_args() -> tuple[BenchmarkConfig, str | None]:
+    defaults = BenchmarkConfig()
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    for name, field in BenchmarkConfig.model_fields.items():
+        flag = f"--{name.replace('_', '-')}"
+        if name == "modes":
+            parser.add_argument(
+                flag, nargs="+", choices=["normal", "pro"], default=defaults.modes
+            )
+        elif field.annotation is bool:
+            parser.add_argument(flag, action="store_true")
+        else:
+            parser.add_argument(
+                flag, type=field.annotation, default=getattr(defaults, name)
+            )
+    parser.add_argument("--json", help="Also write the reports to this file")
+    args = vars(parser.parse_args())
+    json_path = args.pop("json")
+    return BenchmarkConfig(**args), json_path
+
+
+def main():
+    config, json_path = parse_args()
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=serve, args=(config, config.port + i), daemon=True)
+        for i in range(config.workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        reports = asyncio.run(run_benchmark(config, [worker.pid for worker in workers]))
+    finally:
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+
+    for report in reports:
+        print_report(report)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump([report.model_dump() for report in reports], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Generic, TypeVar
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+from backend.metrics import (
+    CACHE_BYTES,
+    CACHE_ENTRIES,
+    CACHE_EVICTIONS,
+    CACHE_LOOKUPS,
+)
+
+load_dotenv()
+
+
+redis_url = os.getenv("REDIS_URL")
+redis_client = redis.Redis.from_url(redis_url) if redis_url else None
+
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """In-process LRU cache bounded by entry count, approximate size and age.
+
+    Entries expire `ttl` seconds after they are set, or after the `ttl` passed
+    to `set`, and are then treated as misses. `size` passed to `set` is the
+    caller's estimate of an entry's footprint in bytes. Lookups, evictions and
+    the cache's size are exported as metrics labelled with `name`.
+    """
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int, ttl: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Expiry time on the monotonic clock, size and value of each entry
+        self.entries: OrderedDict[str, tuple[float, int, V]] = OrderedDict()
+        self.size_bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def get(self, key: str) -> V | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            CACHE_LOOKUPS.labels(self.name, "miss").inc()
+            return None
+
+        expires_at, _, value = entry
+        if time.monotonic() > expires_at:
+            self.delete(key)
+            CACHE_LOOKUPS.labels(self.name, "expired").inc()
+            return None
+
+        self.entries.move_to_end(key)
+        CACHE_LOOKUPS.labels(self.name, "hit").inc()
+        return value
+
+    def set(self, key: str, value: V, size: int, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if not self.enabled or size > self.max_bytes or ttl <= 0:
+            return
+
+        self.delete(key)
+        self.entries[key] = (time.monotonic() + ttl, size, value)
+        self.size_bytes += size
+
+        while len(self.entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+            CACHE_EVICTIONS.labels(self.name).inc()
+        self.update_size()
+
+    def delete(self, key: str) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry[1]
+            self.update_size()
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size_bytes = 0
+        self.update_size()
+
+    def update_size(self) -> None:
+        CACHE_ENTRIES.labels(self.name).set(len(self.entries))
+        CACHE_BYTES.labels(self.name).set(self.size_bytes)
@@ -1,12 +1,18 @@
 import asyncio
+import os
+import time
+from contextlib import aclosing
 from typing import AsyncIterator, List
 
+from dotenv import load_dotenv
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from backend.constants import get_model_string
-from backend.db.chat import save_turn_to_db
-from backend.llm.base import BaseLLM, EveryLLM
+from backend.constants import ChatModel, ModelStage, get_model_string
+from backend.context import CONTEXT_TOKENS_ANSWER, pack_search_results
+from backend.db.writer import save_turn
+from backend.llm.base import BaseLLM, get_llm
+from backend.metrics import record_stage, timed
 from backend.prompts import CHAT_PROMPT, HISTORY_QUERY_REPHRASE
 from backend.related_queries import generate_related_queries
 from backend.schemas import (
@@ -16,17 +22,37 @@ from backend.schemas import (
     FinalResponseStream,
     Message,
     RelatedQueriesStream,
+    SearchResponse,
     SearchResult,
     SearchResultStream,
     StreamEndStream,
     StreamEvent,
-    TextChunkStream,
 )
+from backend.search.cache import normalize_query
+from backend.search.rerank import rerank_search_results
 from backend.search.search_service import perform_search
-from backend.utils import is_local_model
+from backend.streaming import TaskScope, text_chunk_event
+from backend.utils import is_local_model, strtobool
+from backend.validators import get_stage_model
 
+load_dotenv()
 
-def rephrase_query_with_history(
+
+# Search the raw follow-up question while it is being rephrased
+SPECULATIVE_SEARCH_ENABLED = strtobool(os.getenv("SPECULATIVE_SEARCH_ENABLED", False))
+# Minimum word overlap between the raw and rephrased query to keep those results
+SPECULATIVE_SEARCH_SIMILARITY = float(os.getenv("SPECULATIVE_SEARCH_SIMILARITY", 0.8))
+
+
+def get_stage_llm(stage: ModelStage, model: ChatModel, llm: BaseLLM) -> BaseLLM:
+    """LLM for an auxiliary stage, `llm` when it runs on the request's model."""
+    stage_model = get_stage_model(stage, model)
+    if stage_model == model:
+        return llm
+    return get_llm(get_model_string(stage_model))
+
+
+async def rephrase_query_with_history(
     question: str, history: List[Message], llm: BaseLLM
 ) -> str:
     if not history:
@@ -37,7 +63,8 @@ def rephrase_query_with_history(
         formatted_query = HISTORY_QUERY_REPHRASE.format(
             chat_history=history_str, question=question
         )
-        question = llm.complete(formatted_query).text.replace('"', "")
+        with timed("rephrase"):
+            question = (await llm.acomplete(formatted_query)).text.replace('"', "")
         return question
     except Exception:
         raise HTTPException(
@@ -45,6 +72,48 @@ def rephrase_query_with_history(
         )
 
 
+def query_similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the normalized words of two queries."""
+    a_words = set(normalize_query(a).split())
+    b_words = set(normalize_query(b).split())
+    if not a_words or not b_words:
+        return float(a_words == b_words)
+    return len(a_words & b_words) / len(a_words | b_words)
+
+
+def report_speculative_search_error(task: asyncio.Task[SearchResponse]) -> None:
+    """Log why a speculative search failed, as its result may never be awaited."""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Speculative search failed: {task.exception()}")
+
+
+async def rephrase_and_search(
+    question: str, history: List[Message], llm: BaseLLM
+) -> tuple[str, SearchResponse]:
+    """Rephrase a follow-up question and search for it.
+
+    With speculative search enabled, the raw question is searched while the
+    rephrase runs and those results are kept if the rephrased query is close
+    enough, saving the search round-trip after the LLM call.
+    """
+    if not (SPECULATIVE_SEARCH_ENABLED and history):
+        query = await rephrase_query_with_history(question, history, llm)
+        return query, await perform_search(query)
+
+    speculative_search = asyncio.create_task(perform_search(question))
+    speculative_search.add_done_callback(report_speculative_search_error)
+    try:
+        query = await rephrase_query_with_history(question, history, llm)
+        if query_similarity(question, query) >= SPECULATIVE_SEARCH_SIMILARITY:
+            try:
+                return query, await speculative_search
+            except HTTPException:
+                pass
+    finally:
+        speculative_search.cancel()
+    return query, await perform_search(query)
+
+
 def format_context(search_results: List[SearchResult]) -> str:
     return "\n\n".join(
         [f"Citation {i+1}. {str(result)}" for i, result in enumerate(search_results)]
@@ -52,29 +121,40 @@ def format_context(search_results: List[SearchResult]) -> str:
 
 
 async def stream_qa_objects(
-    request: ChatRequest, session: Session
+    request: ChatRequest, session: AsyncSession
 ) -> AsyncIterator[ChatResponseEvent]:
+    scope = TaskScope()
     try:
         model_name = get_model_string(request.model)
-        llm = EveryLLM(model=model_name)
+        llm = get_llm(model_name)
 
         yield ChatResponseEvent(
             event=StreamEvent.BEGIN_STREAM,
             data=BeginStream(query=request.query),
         )
 
-        query = rephrase_query_with_history(request.query, request.history, llm)
+        related_llm = get_stage_llm(ModelStage.RELATED_QUERIES, request.model, llm)
 
-        search_response = await perform_search(query)
+        query, search_response = await rephrase_and_search(
+            request.query,
+            request.history,
+            get_stage_llm(ModelStage.REPHRASE, request.model, llm),
+        )
 
-        search_results = search_response.results
+        # The client is sent the same results, so its citations line up
+        search_results = pack_search_results(
+            rerank_search_results(query, search_response.results),
+            model_name,
+            CONTEXT_TOKENS_ANSWER,
+        )
         images = search_response.images
 
         # Only create the task first if the model is not local
         related_queries_task = None
         if not is_local_model(request.model):
-            related_queries_task = asyncio.create_task(
-                generate_related_queries(query, search_results, llm)
+            related_queries_task = scope.create_task(
+                generate_related_queries(query, search_results, related_llm),
+                name="related_queries",
             )
 
         yield ChatResponseEvent(
@@ -90,19 +170,21 @@ async def stream_qa_objects(
             my_query=query,
         )
 
-        full_response = ""
-        response_gen = await llm.astream(fmt_qa_prompt)
-        async for completion in response_gen:
-            full_response += completion.delta or ""
-            yield ChatResponseEvent(
-                event=StreamEvent.TEXT_CHUNK,
-                data=TextChunkStream(text=completion.delta or ""),
-            )
+        response_chunks: list[str] = []
+        answer_start = time.perf_counter()
+        # Closed right away if the stream is abandoned, ending the LLM request
+        async with aclosing(await llm.astream(fmt_qa_prompt)) as response_gen:
+            async for completion in response_gen:
+                delta = completion.delta or ""
+                response_chunks.append(delta)
+                yield text_chunk_event(delta)
+        record_stage("answer", time.perf_counter() - answer_start)
+        full_response = "".join(response_chunks)
 
         related_queries = await (
             related_queries_task
             if related_queries_task
-            else generate_related_queries(query, search_results, llm)
+            else generate_related_queries(query, search_results, related_llm)
         )
 
         yield ChatResponseEvent(
@@ -110,16 +192,17 @@ async def stream_qa_objects(
             data=RelatedQueriesStream(related_queries=related_queries),
         )
 
-        thread_id = save_turn_to_db(
-            session=session,
-            thread_id=request.thread_id,
-            user_message=request.query,
-            assistant_message=full_response,
-            model=request.model,
-            search_results=search_results,
-            image_results=images,
-            related_queries=related_queries,
-        )
+        with timed("save_turn"):
+            thread_id = await save_turn(
+                session=session,
+                thread_id=request.thread_id,
+                user_message=request.query,
+                assistant_message=full_response,
+                model=request.model,
+                search_results=search_results,
+                image_results=images,
+                related_queries=related_queries,
+            )
 
         yield ChatResponseEvent(
             event=StreamEvent.FINAL_RESPONSE,
@@ -134,3 +217,5 @@ async def stream_qa_objects(
     except Exception as e:
         detail = str(e)
         raise HTTPException(status_code=500, detail=detail)
+    finally:
+        await scope.aclose()
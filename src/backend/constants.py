@@ -35,6 +35,38 @@ model_mappings: dict[ChatModel, str] = {
 }
 
 
+class ModelStage(str, Enum):
+    REPHRASE = "rephrase"
+    QUERY_PLAN = "query_plan"
+    SEARCH_QUERIES = "search_queries"
+    RELATED_QUERIES = "related_queries"
+
+
+def get_configured_model(env_var: str) -> ChatModel | None:
+    value = os.environ.get(env_var)
+    if not value:
+        return None
+    try:
+        return ChatModel(value)
+    except ValueError:
+        raise ValueError(f"{env_var} must be one of {[m.value for m in ChatModel]}")
+
+
+# Auxiliary stages run on the model chosen for the request unless configured
+# here. AUXILIARY_MODEL applies to every stage without its own setting.
+AUXILIARY_MODEL = get_configured_model("AUXILIARY_MODEL")
+stage_models: dict[ModelStage, ChatModel | None] = {
+    ModelStage.REPHRASE: get_configured_model("REPHRASE_MODEL") or AUXILIARY_MODEL,
+    ModelStage.QUERY_PLAN: get_configured_model("QUERY_PLAN_MODEL") or AUXILIARY_MODEL,
+    ModelStage.SEARCH_QUERIES: (
+        get_configured_model("SEARCH_QUERIES_MODEL") or AUXILIARY_MODEL
+    ),
+    ModelStage.RELATED_QUERIES: (
+        get_configured_model("RELATED_QUERIES_MODEL") or AUXILIARY_MODEL
+    ),
+}
+
+
 def get_model_string(model: ChatModel) -> str:
     if model == ChatModel.CUSTOM:
         custom_model = os.environ.get("CUSTOM_MODEL")
@@ -0,0 +1,100 @@
+import os
+from functools import lru_cache
+
+import litellm
+from dotenv import load_dotenv
+
+from backend.schemas import SearchResult
+from backend.search.cache import normalize_query
+
+load_dotenv()
+
+
+# Tokens of search results in the answer prompt, shared by all pro search steps
+CONTEXT_TOKENS_ANSWER = int(os.getenv("CONTEXT_TOKENS_ANSWER", 3000))
+# ...in the context one pro search step passes on to the steps after it
+CONTEXT_TOKENS_STEP = int(os.getenv("CONTEXT_TOKENS_STEP", 1500))
+# ...in the related questions prompt
+CONTEXT_TOKENS_RELATED = int(os.getenv("CONTEXT_TOKENS_RELATED", 1000))
+# Most of the model's context window that search results may take up
+CONTEXT_WINDOW_SHARE = float(os.getenv("CONTEXT_WINDOW_SHARE", 0.5))
+# Results sharing this much of their wording with a better ranked one are dropped
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", 0.8))
+
+
+@lru_cache(maxsize=None)
+def max_input_tokens(model: str) -> int | None:
+    try:
+        return litellm.get_model_info(model)["max_input_tokens"]
+    except Exception:
+        return None
+
+
+def context_budget(model: str, tokens: int) -> int:
+    """`tokens`, capped at the model's share of its context window."""
+    window = max_input_tokens(model)
+    if window:
+        return min(tokens, int(window * CONTEXT_WINDOW_SHARE))
+    return tokens
+
+
+# Search results are packed for several prompts per request and come back from
+# the search cache, so their counts and shingles are kept rather than redone
+@lru_cache(maxsize=4096)
+def count_tokens(model: str, text: str) -> int:
+    """Tokens in `text` for the model's tokenizer, estimated if it is unknown."""
+    try:
+        return litellm.token_counter(model=model, text=text)
+    except Exception:
+        return len(text) // 4 + 1
+
+
+@lru_cache(maxsize=4096)
+def shingles(text: str, size: int = 3) -> frozenset[tuple[str, ...]]:
+    words = normalize_query(text).split()
+    if len(words) <= size:
+        return frozenset({tuple(words)})
+    return frozenset(tuple(words[i : i + size]) for i in range(len(words) - size + 1))
+
+
+def is_near_duplicate(
+    words: frozenset[tuple[str, ...]], kept: list[frozenset[tuple[str, ...]]]
+) -> bool:
+    return any(
+        len(words & other) / len(words | other) >= CONTEXT_DUPLICATE_SIMILARITY
+        for other in kept
+        if words and other
+    )
+
+
+def pack_search_results(
+    search_results: list[SearchResult], model: str, tokens: int
+) -> list[SearchResult]:
+    """The best ranked whole results that fit in a token budget.
+
+    Results are taken in rank order, skipping near-duplicates of ones already
+    taken and any that no longer fit. If not even the top result fits, it is
+    cut down to the budget so the prompt still has some context.
+    """
+    budget = context_budget(model, tokens)
+    packed: list[SearchResult] = []
+    kept_shingles: list[frozenset[tuple[str, ...]]] = []
+    used = 0
+    for result in search_results:
+        if used >= budget:
+            break
+        words = shingles(result.content)
+        if is_near_duplicate(words, kept_shingles):
+            continue
+        cost = count_tokens(model, str(result))
+        if used + cost > budget:
+            continue
+        packed.append(result)
+        kept_shingles.append(words)
+        used += cost
+
+    if not packed and search_results:
+        top = search_results[0]
+        keep = len(top.content) * budget // count_tokens(model, str(top))
+        packed.append(top.model_copy(update={"content": top.content[:keep]}))
+    return packed
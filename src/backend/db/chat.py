@@ -1,50 +1,101 @@
-import json
+import base64
 import re
+from datetime import datetime
 
-from sqlalchemy import select
-from sqlalchemy.orm import Session, contains_eager
+from sqlalchemy import func, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from backend.db.models import ChatMessage as DBChatMessage
 from backend.db.models import ChatThread as DBChatThread
-from backend.db.models import SearchResult as DBSearchResult
+from backend.db.models import ChatMessageSource as DBChatMessageSource
+from backend.db.models import Source as DBSource
+from backend.db.thread_cache import thread_cache
 from backend.schemas import (
     AgentSearchFullResponse,
+    ChatHistoryResponse,
     ChatMessage,
     ChatSnapshot,
     MessageRole,
     SearchResult,
     ThreadResponse,
 )
-from backend.utils import DB_ENABLED
+from backend.utils import DB_ENABLED, canonicalize_url
 
 
-def create_chat_thread(*, session: Session, model_name: str):
-    chat_thread = DBChatThread(model_name=model_name)
+async def reserve_chat_thread_id(*, session: AsyncSession) -> int:
+    result = await session.execute(
+        text("SELECT nextval(pg_get_serial_sequence('chat_thread', 'id'))")
+    )
+    return result.scalar_one()
+
+
+async def create_chat_thread(
+    *, session: AsyncSession, model_name: str, thread_id: int | None = None
+):
+    chat_thread = DBChatThread(id=thread_id, model_name=model_name)
     session.add(chat_thread)
-    session.commit()
+    await session.flush()
     return chat_thread
 
 
-def create_search_results(
-    *, session: Session, search_results: list[SearchResult], chat_message_id: int
-) -> list[DBSearchResult]:
-    db_search_results = [
-        DBSearchResult(
-            url=result.url,
-            title=result.title,
-            content=result.content,
-            chat_message_id=chat_message_id,
+async def upsert_sources(
+    *, session: AsyncSession, search_results: list[SearchResult]
+) -> dict[str, int]:
+    """Store each canonical URL once, returning source ids by canonical URL.
+
+    An existing source is updated to the latest title and snippet seen for it.
+    """
+    sources = {}
+    for result in search_results:
+        url = canonicalize_url(result.url)
+        sources.setdefault(
+            url, {"url": url, "title": result.title, "content": result.content}
         )
-        for result in search_results
-    ]
-    session.add_all(db_search_results)
-    session.commit()
-    return db_search_results
+    if not sources:
+        return {}
+
+    # A known URL takes the latest title and snippet, which every message citing
+    # it then shows. Unchanged rows are left alone, so look all ids up afterwards.
+    # Rows go in URL order so concurrent turns lock shared sources consistently.
+    stmt = insert(DBSource).values([sources[url] for url in sorted(sources)])
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[DBSource.url],
+            set_={"title": stmt.excluded.title, "content": stmt.excluded.content},
+            where=(DBSource.title != stmt.excluded.title)
+            | (DBSource.content != stmt.excluded.content),
+        )
+    )
+    rows = await session.execute(
+        select(DBSource.url, DBSource.id).where(DBSource.url.in_(sources))
+    )
+    return {url: source_id for url, source_id in rows}
+
+
+async def create_message_sources(
+    *, session: AsyncSession, search_results: list[SearchResult], chat_message_id: int
+) -> None:
+    source_ids = await upsert_sources(session=session, search_results=search_results)
+    if not source_ids:
+        return
+    await session.execute(
+        insert(DBChatMessageSource),
+        [
+            {
+                "chat_message_id": chat_message_id,
+                "rank": rank,
+                "source_id": source_ids[canonicalize_url(result.url)],
+            }
+            for rank, result in enumerate(search_results)
+        ],
+    )
 
 
-def append_message(
+async def append_message(
     *,
-    session: Session,
+    session: AsyncSession,
     thread_id: int,
     role: MessageRole,
     content: str,
@@ -52,28 +103,28 @@ def append_message(
     image_results: list[str] | None = None,
     related_queries: list[str] | None = None,
 ):
-    last_message = (
-        session.query(DBChatMessage)
-        .filter(DBChatMessage.chat_thread_id == thread_id)
+    last_message_id = await session.scalar(
+        select(DBChatMessage.id)
+        .where(DBChatMessage.chat_thread_id == thread_id)
         .order_by(DBChatMessage.id.desc())
-        .first()
+        .limit(1)
     )
 
-    return create_message(
+    return await create_message(
         session=session,
         thread_id=thread_id,
         role=role,
         content=content,
-        parent_message_id=last_message.id if last_message else None,
+        parent_message_id=last_message_id,
         search_results=search_results,
         image_results=image_results,
         related_queries=related_queries,
     )
 
 
-def create_message(
+async def create_message(
     *,
-    session: Session,
+    session: AsyncSession,
     thread_id: int,
     role: MessageRole,
     content: str,
@@ -89,7 +140,7 @@ def create_message(
         content=content,
         parent_message_id=parent_message_id,
         agent_search_full_response=(
-            agent_search_full_response.model_dump_json()
+            agent_search_full_response.model_dump(mode="json")
             if agent_search_full_response
             else None
         ),
@@ -98,23 +149,18 @@ def create_message(
     )
 
     session.add(message)
-    session.flush()
+    await session.flush()
 
-    db_search_results = None
-    if search_results is not None:
-        db_search_results = create_search_results(
+    if search_results:
+        await create_message_sources(
             session=session, search_results=search_results, chat_message_id=message.id
         )
-    message.search_results = db_search_results or []
-
-    session.add(message)
-    session.commit()
     return message
 
 
-def save_turn_to_db(
+async def save_turn_to_db(
     *,
-    session: Session,
+    session: AsyncSession,
     thread_id: int | None,
     user_message: str,
     assistant_message: str,
@@ -123,22 +169,28 @@ def save_turn_to_db(
     search_results: list[SearchResult] | None = None,
     image_results: list[str] | None = None,
     related_queries: list[str] | None = None,
+    new_thread: bool = False,
 ) -> int | None:
+    """Save a user/assistant turn in a single transaction.
+
+    A new thread is created when `thread_id` is None, or with the given id when
+    `new_thread` is set (the id was reserved with `reserve_chat_thread_id`).
+    """
     if DB_ENABLED:
-        if thread_id is None:
-            thread = create_chat_thread(session=session, model_name=model)
+        if thread_id is None or new_thread:
+            thread = await create_chat_thread(
+                session=session, model_name=model, thread_id=thread_id
+            )
             thread_id = thread.id
-        else:
-            thread_id = thread_id
 
-        user_message = append_message(
+        user_message = await append_message(
             session=session,
             thread_id=thread_id,
             role=MessageRole.USER,
             content=user_message,
         )
 
-        _assistant_message = create_message(
+        _assistant_message = await create_message(
             session=session,
             thread_id=thread_id,
             role=MessageRole.ASSISTANT,
@@ -149,71 +201,164 @@ def save_turn_to_db(
             image_results=image_results,
             related_queries=related_queries,
         )
+        await session.commit()
+        await thread_cache.invalidate(thread_id)
         return thread_id
     return None
 
 
-def get_chat_history(*, session: Session) -> list[ChatSnapshot]:
-    threads = (
-        session.query(DBChatThread)
-        .join(DBChatThread.messages)
-        .options(contains_eager(DBChatThread.messages))
-        .order_by(DBChatThread.time_created.desc(), DBChatMessage.id.asc())
-        .all()
+# The sidebar only shows a couple of lines of the first answer
+HISTORY_PREVIEW_LENGTH = 500
+
+
+def encode_history_cursor(time_created: datetime, thread_id: int) -> str:
+    cursor = f"{time_created.isoformat()}|{thread_id}"
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_history_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        time_created, thread_id = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        )
+        return datetime.fromisoformat(time_created), int(thread_id)
+    except Exception:
+        raise ValueError("Invalid history cursor")
+
+
+def first_thread_message(role: MessageRole, length: int | None = None):
+    content = DBChatMessage.content
+    if length is not None:
+        content = func.left(content, length)
+    return (
+        select(content)
+        .where(
+            DBChatMessage.chat_thread_id == DBChatThread.id,
+            DBChatMessage.role == role,
+        )
+        .order_by(DBChatMessage.id.asc())
+        .limit(1)
+        .correlate(DBChatThread)
+        .scalar_subquery()
     )
-    threads = [thread for thread in threads if len(thread.messages) > 1]
-
-    snapshots = []
-    for thread in threads:
-        title = thread.messages[0].content
-        preview = thread.messages[1].content
-
-        # Remove citations from the preview
-        citation_regex = re.compile(r"\[[0-9]+\]")
-        preview = citation_regex.sub("", preview)
-
-        snapshots.append(
-            ChatSnapshot(
-                id=thread.id,
-                title=title,
-                date=thread.time_created,
-                preview=preview,
-                model_name=thread.model_name,
-            )
+
+
+async def get_chat_history(
+    *, session: AsyncSession, limit: int = 20, cursor: str | None = None
+) -> ChatHistoryResponse:
+    """Return one page of threads, newest first.
+
+    Only the first question and the start of the first answer of each thread
+    are read, and pages are keyed on (time_created, id) so every page is an
+    index range scan no matter how much history there is.
+    """
+    has_answer = (
+        select(DBChatMessage.id)
+        .where(
+            DBChatMessage.chat_thread_id == DBChatThread.id,
+            DBChatMessage.role == MessageRole.ASSISTANT,
+        )
+        .exists()
+    )
+    stmt = (
+        select(
+            DBChatThread.id,
+            DBChatThread.time_created,
+            DBChatThread.model_name,
+            first_thread_message(MessageRole.USER).label("title"),
+            first_thread_message(
+                MessageRole.ASSISTANT, length=HISTORY_PREVIEW_LENGTH
+            ).label("preview"),
+        )
+        .where(has_answer)
+        .order_by(DBChatThread.time_created.desc(), DBChatThread.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        cursor_time, cursor_id = decode_history_cursor(cursor)
+        stmt = stmt.where(
+            tuple_(DBChatThread.time_created, DBChatThread.id)
+            < tuple_(cursor_time, cursor_id)
+        )
+
+    rows = (await session.execute(stmt)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1].time_created, rows[-1].id)
+
+    # Remove citations from the preview
+    citation_regex = re.compile(r"\[[0-9]+\]")
+    snapshots = [
+        ChatSnapshot(
+            id=row.id,
+            title=row.title or "",
+            date=row.time_created,
+            preview=citation_regex.sub("", row.preview or ""),
+            model_name=row.model_name,
         )
-    return snapshots
+        for row in rows
+    ]
+    return ChatHistoryResponse(snapshots=snapshots, next_cursor=next_cursor)
 
 
-def map_search_result(search_result: DBSearchResult) -> SearchResult:
+def map_source(source: DBSource) -> SearchResult:
     return SearchResult(
-        url=search_result.url,
-        title=search_result.title,
-        content=search_result.content,
+        url=source.url,
+        title=source.title,
+        content=source.content,
     )
 
 
-def get_thread(*, session: Session, thread_id: int) -> ThreadResponse:
+async def get_thread(
+    *,
+    session: AsyncSession,
+    thread_id: int,
+    limit: int | None = None,
+    before: int | None = None,
+) -> ThreadResponse:
+    """Load a thread and its sources in two queries.
+
+    With `limit`, only the newest `limit` messages older than the message id
+    `before` are returned, and `next_before` points at the next older page.
+    """
+    # Relationships cannot be lazy loaded on an AsyncSession, load them upfront
     stmt = (
         select(DBChatMessage)
         .where(DBChatMessage.chat_thread_id == thread_id)
-        .order_by(DBChatMessage.id.asc())
+        .options(selectinload(DBChatMessage.sources))
     )
-    db_messages = session.execute(stmt).scalars().all()
-    if len(db_messages) == 0:
+    if before is not None:
+        stmt = stmt.where(DBChatMessage.id < before)
+
+    if limit is None:
+        db_messages = (
+            (await session.execute(stmt.order_by(DBChatMessage.id.asc())))
+            .scalars()
+            .all()
+        )
+    else:
+        stmt = stmt.order_by(DBChatMessage.id.desc()).limit(limit + 1)
+        db_messages = list(reversed((await session.execute(stmt)).scalars().all()))
+
+    if len(db_messages) == 0 and before is None:
         raise ValueError(f"Thread with id {thread_id} not found")
 
+    next_before = None
+    if limit is not None and len(db_messages) > limit:
+        db_messages = db_messages[1:]
+        next_before = db_messages[0].id
+
     messages = [
         ChatMessage(
             content=message.content,
             role=message.role,
             related_queries=message.related_queries or [],
-            sources=[
-                map_search_result(result) for result in message.search_results or []
-            ],
+            sources=[map_source(source) for source in message.sources],
             images=message.image_results or [],
             agent_response=(
-                AgentSearchFullResponse(
-                    **json.loads(message.agent_search_full_response)
+                AgentSearchFullResponse.model_validate(
+                    message.agent_search_full_response
                 )
                 if message.agent_search_full_response
                 else None
@@ -221,4 +366,6 @@ def get_thread(*, session: Session, thread_id: int) -> ThreadResponse:
         )
         for message in db_messages
     ]
-    return ThreadResponse(thread_id=thread_id, messages=messages)
+    return ThreadResponse(
+        thread_id=thread_id, messages=messages, next_before=next_before
+    )
@@ -1,8 +1,10 @@
 import os
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from backend.utils import strtobool
 
 load_dotenv()
 
@@ -17,14 +19,37 @@ DATABASE_URL = (
     or f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 )
 
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = strtobool(os.environ.get("DB_POOL_PRE_PING", True))
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+
 
 def create_connection_string():
+    """Sync (psycopg2) connection string, used by Alembic migrations."""
     return DATABASE_URL
 
 
-engine = create_engine(create_connection_string())
+def create_async_connection_string():
+    url = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
+    return url.render_as_string(hide_password=False)
+
+
+engine = create_async_engine(
+    create_async_connection_string(),
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+)
+
+async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 
-def get_session():
-    with Session(engine) as session:
+async def get_session():
+    async with async_session() as session:
         yield session
@@ -1,6 +1,15 @@
 import datetime
 
-from sqlalchemy import ARRAY, DateTime, Enum, ForeignKey, String, func
+from sqlalchemy import (
+    ARRAY,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    func,
+)
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Mapped, declarative_base, mapped_column, relationship
 
@@ -27,18 +36,29 @@ class ChatThread(Base):
         DateTime(timezone=True), server_default=func.now()
     )
 
+    # Keyset pagination of the history, newest first
+    __table_args__ = (Index("ix_chat_thread_time_created_id", "time_created", "id"),)
 
-class SearchResult(Base):
-    __tablename__ = "search_result"
+
+class Source(Base):
+    """A search result, stored once per canonical URL."""
+
+    __tablename__ = "source"
     id: Mapped[int] = mapped_column(primary_key=True)
+    url: Mapped[str] = mapped_column(String, unique=True)
     title: Mapped[str] = mapped_column(String)
-    url: Mapped[str] = mapped_column(String)
     content: Mapped[str] = mapped_column(String)
 
-    chat_message_id: Mapped[int] = mapped_column(ForeignKey("chat_message.id"))
-    chat_message: Mapped["ChatMessage"] = relationship(
-        "ChatMessage", back_populates="search_results"
+
+class ChatMessageSource(Base):
+    """Links a message to its sources, `rank` is the citation order."""
+
+    __tablename__ = "chat_message_source"
+    chat_message_id: Mapped[int] = mapped_column(
+        ForeignKey("chat_message.id"), primary_key=True
     )
+    rank: Mapped[int] = mapped_column(Integer, primary_key=True)
+    source_id: Mapped[int] = mapped_column(ForeignKey("source.id"), index=True)
 
 
 class ChatMessage(Base):
@@ -56,7 +76,7 @@ class ChatMessage(Base):
     )
 
     # AI Only
-    agent_search_full_response: Mapped[str | None] = mapped_column(
+    agent_search_full_response: Mapped[dict | None] = mapped_column(
         postgresql.JSONB, nullable=True
     )
 
@@ -67,6 +87,14 @@ class ChatMessage(Base):
         ARRAY(String), nullable=True
     )
 
-    search_results: Mapped[list[SearchResult] | None] = relationship(
-        SearchResult, back_populates="chat_message"
+    sources: Mapped[list[Source]] = relationship(
+        Source,
+        secondary="chat_message_source",
+        order_by="ChatMessageSource.rank",
+        viewonly=True,
+    )
+
+    # First question / answer of a thread, and the messages of a thread in order
+    __table_args__ = (
+        Index("ix_chat_message_chat_thread_id_role_id", "chat_thread_id", "role", "id"),
     )
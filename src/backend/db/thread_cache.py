@@ -0,0 +1,89 @@
+import os
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+
+from backend.cache import redis_client
+
+load_dotenv()
+
+
+# Set to 0 to disable caching of serialized threads
+THREAD_CACHE_TTL = int(os.getenv("THREAD_CACHE_TTL", 3600))
+
+
+def thread_cache_key(thread_id: int) -> str:
+    return f"thread:{thread_id}"
+
+
+def thread_generation_key(thread_id: int) -> str:
+    return f"thread:{thread_id}:gen"
+
+
+# Only cache the payload if no save has bumped the generation since it was read
+SET_IF_GENERATION = """
+if (redis.call('GET', KEYS[2]) or '0') == ARGV[2] then
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+end
+"""
+
+
+class ThreadCache:
+    """Serialized `ThreadResponse` payloads in Redis, keyed by thread.
+
+    Only full threads are cached. Every save to a thread drops its entry and
+    bumps the thread's generation. A read notes the generation on a miss and
+    only caches what it loaded if the generation is still the same, so a read
+    racing a save cannot cache the older copy.
+    """
+
+    def __init__(self, redis_client: redis.Redis | None, ttl: int = THREAD_CACHE_TTL):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.set_if_generation = (
+            redis_client.register_script(SET_IF_GENERATION) if redis_client else None
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.redis_client is not None and self.ttl > 0
+
+    async def get(self, thread_id: int) -> tuple[bytes | None, bytes | None]:
+        """The cached payload and the thread's generation, to pass to `set`."""
+        if not self.enabled:
+            return None, None
+        try:
+            payload, generation = await self.redis_client.mget(
+                thread_cache_key(thread_id), thread_generation_key(thread_id)
+            )
+            return payload, generation
+        except Exception as e:
+            print(f"Error reading thread cache: {e}")
+            return None, None
+
+    async def set(self, thread_id: int, payload: str, generation: bytes | None) -> None:
+        if not self.enabled:
+            return
+        try:
+            await self.set_if_generation(
+                keys=[thread_cache_key(thread_id), thread_generation_key(thread_id)],
+                args=[payload, generation or b"0", self.ttl],
+            )
+        except Exception as e:
+            print(f"Error writing thread cache: {e}")
+
+    async def invalidate(self, thread_id: int) -> None:
+        if not self.enabled:
+            return
+        try:
+            async with self.redis_client.pipeline(transaction=True) as pipe:
+                pipe.incr(thread_generation_key(thread_id))
+                # Outlive any read that noted the previous generation
+                pipe.expire(thread_generation_key(thread_id), self.ttl)
+                pipe.delete(thread_cache_key(thread_id))
+                await pipe.execute()
+        except Exception as e:
+            print(f"Error invalidating thread cache: {e}")
+
+
+thread_cache = ThreadCache(redis_client)
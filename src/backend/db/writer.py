@@ -0,0 +1,165 @@
+import asyncio
+import os
+from collections import Counter
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.db.chat import reserve_chat_thread_id, save_turn_to_db
+from backend.db.engine import async_session
+from backend.metrics import DB_TURN_WRITES
+from backend.schemas import AgentSearchFullResponse, SearchResult
+from backend.utils import DB_ENABLED, strtobool
+
+load_dotenv()
+
+
+DB_WRITE_BEHIND_ENABLED = strtobool(os.getenv("DB_WRITE_BEHIND_ENABLED", False))
+DB_WRITE_QUEUE_SIZE = int(os.getenv("DB_WRITE_QUEUE_SIZE", 1000))
+DB_WRITE_MAX_RETRIES = int(os.getenv("DB_WRITE_MAX_RETRIES", 3))
+DB_WRITE_FLUSH_TIMEOUT = float(os.getenv("DB_WRITE_FLUSH_TIMEOUT", 30))
+
+
+class PendingTurn(BaseModel):
+    thread_id: int
+    new_thread: bool
+    user_message: str
+    assistant_message: str
+    model: str
+    agent_search_full_response: AgentSearchFullResponse | None = None
+    search_results: list[SearchResult] | None = None
+    image_results: list[str] | None = None
+    related_queries: list[str] | None = None
+
+
+async def write_turn(turn: PendingTurn) -> None:
+    async with async_session() as session:
+        await save_turn_to_db(session=session, **dict(turn))
+
+
+class TurnWriter:
+    """Persists chat turns on a background worker, off the request path.
+
+    Each turn is written in one transaction. Turns are written one at a time
+    in the order they were queued, so follow-ups to the same thread always
+    land after the turn that created it. That order only holds within one
+    process: with write-behind on, run a single app worker or route each
+    conversation to the same worker.
+    """
+
+    def __init__(self, max_queue_size: int, max_retries: int):
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.queue: asyncio.Queue[PendingTurn] | None = None
+        self.worker: asyncio.Task | None = None
+        # Queued turns by thread, and events set once a thread has none left
+        self.pending: Counter[int] = Counter()
+        self.thread_written: dict[int, asyncio.Event] = {}
+
+    @property
+    def running(self) -> bool:
+        return self.worker is not None and not self.worker.done()
+
+    def start(self) -> None:
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.worker = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float = DB_WRITE_FLUSH_TIMEOUT) -> None:
+        if self.queue is None or self.worker is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"Dropping {self.queue.qsize()} unsaved turns on shutdown")
+            DB_TURN_WRITES.labels("dropped").inc(self.queue.qsize())
+        self.worker.cancel()
+        self.worker = None
+
+    async def submit(
+        self,
+        *,
+        session: AsyncSession,
+        thread_id: int | None,
+        **turn,
+    ) -> int:
+        """Reserve the thread id and queue the turn, returning the thread id."""
+        new_thread = thread_id is None
+        if new_thread:
+            thread_id = await reserve_chat_thread_id(session=session)
+            await session.commit()
+
+        self.pending[thread_id] += 1
+        self.thread_written.setdefault(thread_id, asyncio.Event())
+        try:
+            # Blocks while the queue is full, pushing back on new turns
+            await self.queue.put(
+                PendingTurn(thread_id=thread_id, new_thread=new_thread, **turn)
+            )
+        except BaseException:
+            # The request went away while waiting for room in the queue
+            print(f"Dropping unsaved turn for thread {thread_id}")
+            DB_TURN_WRITES.labels("dropped").inc()
+            self.turn_done(thread_id)
+            raise
+        return thread_id
+
+    def turn_done(self, thread_id: int) -> None:
+        self.pending[thread_id] -= 1
+        if self.pending[thread_id] <= 0:
+            del self.pending[thread_id]
+            self.thread_written.pop(thread_id).set()
+
+    async def wait_for_thread(
+        self, thread_id: int, timeout: float = DB_WRITE_FLUSH_TIMEOUT
+    ) -> None:
+        """Wait until the queued turns of a thread are written, so reads see them."""
+        written = self.thread_written.get(thread_id)
+        if written is None:
+            return
+        try:
+            await asyncio.wait_for(written.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self) -> None:
+        while True:
+            turn = await self.queue.get()
+            try:
+                await self.write_with_retries(turn)
+            except asyncio.CancelledError:
+                DB_TURN_WRITES.labels("dropped").inc()
+                raise
+            finally:
+                self.queue.task_done()
+                self.turn_done(turn.thread_id)
+
+    async def write_with_retries(self, turn: PendingTurn) -> None:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await write_turn(turn)
+                DB_TURN_WRITES.labels("written").inc()
+                return
+            except Exception as e:
+                print(
+                    f"Error saving turn for thread {turn.thread_id} (attempt {attempt + 1}): {e}"
+                )
+                if attempt < self.max_retries:
+                    DB_TURN_WRITES.labels("retried").inc()
+                    await asyncio.sleep(0.5 * 2**attempt)
+        print(f"Giving up on saving turn for thread {turn.thread_id}")
+        DB_TURN_WRITES.labels("failed").inc()
+
+
+turn_writer = TurnWriter(
+    max_queue_size=DB_WRITE_QUEUE_SIZE, max_retries=DB_WRITE_MAX_RETRIES
+)
+
+
+async def save_turn(
+    *, session: AsyncSession, thread_id: int | None, **turn
+) -> int | None:
+    """Save a chat turn, through the write-behind queue when it is running."""
+    if DB_ENABLED and turn_writer.running:
+        return await turn_writer.submit(session=session, thread_id=thread_id, **turn)
+    return await save_turn_to_db(session=session, thread_id=thread_id, **turn)
@@ -3,10 +3,12 @@ import json
 import re
 from abc import ABC, abstractmethod
 
+import httpx
 import instructor
+import litellm
 from dotenv import load_dotenv
 from instructor.client import T
-from litellm import completion
+from litellm import acompletion, completion
 from litellm.utils import validate_environment
 from llama_index.core.base.llms.types import (
     CompletionResponse,
@@ -14,9 +16,27 @@ from llama_index.core.base.llms.types import (
 )
 from llama_index.llms.litellm import LiteLLM
 
+from backend.metrics import STRUCTURED_OUTPUT_ATTEMPTS, STRUCTURED_OUTPUT_RESULTS
+
 load_dotenv()
 
 
+# Pooled HTTP clients shared by every litellm call
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 100))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+LLM_HTTP_TIMEOUT = float(os.getenv("LLM_HTTP_TIMEOUT", 600))
+# Times instructor re-asks the model when its output fails validation, 2 is
+# instructor's own default
+STRUCTURED_OUTPUT_MAX_RETRIES = int(os.getenv("STRUCTURED_OUTPUT_MAX_RETRIES", 2))
+# Ollama models are slow to re-ask, so by default the raw output of their first
+# attempt goes straight to our JSON repair
+OLLAMA_STRUCTURED_OUTPUT_MAX_RETRIES = int(
+    os.getenv("OLLAMA_STRUCTURED_OUTPUT_MAX_RETRIES", 0)
+)
+
+
 def repair_json(json_string):
     """Attempt to repair malformed JSON by fixing common issues."""
     try:
@@ -153,7 +173,77 @@ def repair_json(json_string):
             raise e
 
 
+OLLAMA_JSON_INSTRUCTIONS = "\n\nIMPORTANT: Your response must be properly formatted JSON that can be parsed. Do not include any text outside the JSON structure. Format arrays on a single line without line breaks, like: [1, 2, 3] not as multi-line arrays."
+
+
+def parse_structured_output(
+    response_model: type[T], content: str, error: Exception
+) -> T:
+    """Parse raw model output into `response_model` with our JSON repair fallbacks.
+
+    `error` is the original instructor error and is re-raised when nothing works.
+    """
+    print(f"Raw response content: {content[:200]}...")
+
+    try:
+        # Extract JSON from markdown if needed
+        json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', content)
+        if json_match:
+            json_str = json_match.group(1)
+            print(f"Extracted JSON from markdown: {json_str[:100]}...")
+        else:
+            json_str = content
+
+        # Try to repair and parse the JSON
+        json_obj = repair_json(json_str)
+
+        # Create an instance of the response model
+        result = response_model.model_validate(json_obj)
+        print(f"Successfully parsed with custom repair method!")
+        return result
+    except Exception as json_err:
+        print(f"JSON repair failed: {json_err}")
+
+        # Special handling for QueryPlan as ultimate fallback
+        if response_model.__name__ == 'QueryPlan' and hasattr(response_model, 'extract_steps_from_text'):
+            try:
+                print("Attempting direct text extraction for QueryPlan")
+                # Try the direct extraction method
+                return response_model.extract_steps_from_text(content)
+            except Exception as extract_err:
+                print(f"Direct extraction failed: {extract_err}")
+
+        raise error  # Re-raise the original error if our repair failed
+
+
+def counted_completion(*args, **kwargs):
+    """`completion` for instructor, counting every attempt including re-asks."""
+    STRUCTURED_OUTPUT_ATTEMPTS.labels(kwargs.get("model", "")).inc()
+    return completion(*args, **kwargs)
+
+
+async def counted_acompletion(*args, **kwargs):
+    STRUCTURED_OUTPUT_ATTEMPTS.labels(kwargs.get("model", "")).inc()
+    return await acompletion(*args, **kwargs)
+
+
+def completion_text(response) -> str | None:
+    """Raw text of a chat completion, from its message or its first tool call."""
+    try:
+        message = response.choices[0].message
+    except (AttributeError, IndexError):
+        return None
+    if message.content:
+        return message.content
+    if getattr(message, "tool_calls", None):
+        return message.tool_calls[0].function.arguments
+    return None
+
+
 class BaseLLM(ABC):
+    # litellm model string, used to pick a tokenizer and context window
+    model: str = ""
+
     @abstractmethod
     async def astream(self, prompt: str) -> CompletionResponseAsyncGen:
         pass
@@ -166,6 +256,14 @@ class BaseLLM(ABC):
     def structured_complete(self, response_model: type[T], prompt: str) -> T:
         pass
 
+    @abstractmethod
+    async def acomplete(self, prompt: str) -> CompletionResponse:
+        pass
+
+    @abstractmethod
+    async def astructured_complete(self, response_model: type[T], prompt: str) -> T:
+        pass
+
 
 class EveryLLM(BaseLLM):
     def __init__(
@@ -178,14 +276,17 @@ class EveryLLM(BaseLLM):
         if validation["missing_keys"]:
             raise ValueError(f"Missing keys: {validation['missing_keys']}")
 
+        self.model = model
         self.llm = LiteLLM(model=model)
         # Use MD_JSON mode for all local models (ollama) to handle less structured outputs
         if 'ollama' in model:
-            self.client = instructor.from_litellm(completion, mode=instructor.Mode.MD_JSON)
+            mode = instructor.Mode.MD_JSON
         elif 'groq' in model:
-            self.client = instructor.from_litellm(completion, mode=instructor.Mode.MD_JSON)
+            mode = instructor.Mode.MD_JSON
         else:
-            self.client = instructor.from_litellm(completion)
+            mode = instructor.Mode.TOOLS
+        self.client = instructor.from_litellm(counted_completion, mode=mode)
+        self.aclient = instructor.from_litellm(counted_acompletion, mode=mode)
 
     async def astream(self, prompt: str) -> CompletionResponseAsyncGen:
         return await self.llm.astream_complete(prompt)
@@ -193,62 +294,122 @@ class EveryLLM(BaseLLM):
     def complete(self, prompt: str) -> CompletionResponse:
         return self.llm.complete(prompt)
 
-    def structured_complete(self, response_model: type[T], prompt: str) -> T:
+    def structured_messages(self, prompt: str) -> list[dict]:
         # Add explicit instructions for better JSON formatting when using Ollama models
         if 'ollama' in self.llm.model:
-            prompt = f"{prompt}\n\nIMPORTANT: Your response must be properly formatted JSON that can be parsed. Do not include any text outside the JSON structure. Format arrays on a single line without line breaks, like: [1, 2, 3] not as multi-line arrays."
-            
-            try:
-                # First try with instructor
-                return self.client.chat.completions.create(
-                    model=self.llm.model,
-                    messages=[{"role": "user", "content": prompt}],
-                    response_model=response_model,
-                )
-            except Exception as e:
-                print(f"Instructor parsing failed: {str(e)}")
-                # If that fails, try with our custom JSON repair
-                response = completion(
-                    model=self.llm.model,
-                    messages=[{"role": "user", "content": prompt}],
-                )
-                
-                content = response.choices[0].message.content
-                print(f"Raw response content: {content[:200]}...")
-                
-                try:
-                    # Extract JSON from markdown if needed
-                    json_match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', content)
-                    if json_match:
-                        json_str = json_match.group(1)
-                        print(f"Extracted JSON from markdown: {json_str[:100]}...")
-                    else:
-                        json_str = content
-                        
-                    # Try to repair and parse the JSON
-                    json_obj = repair_json(json_str)
-                    
-                    # Create an instance of the response model
-                    result = response_model.model_validate(json_obj)
-                    print(f"Successfully parsed with custom repair method!")
-                    return result
-                except Exception as json_err:
-                    print(f"JSON repair failed: {json_err}")
-                    
-                    # Special handling for QueryPlan as ultimate fallback
-                    if response_model.__name__ == 'QueryPlan' and hasattr(response_model, 'extract_steps_from_text'):
-                        try:
-                            print("Attempting direct text extraction for QueryPlan")
-                            # Try the direct extraction method
-                            return response_model.extract_steps_from_text(content)
-                        except Exception as extract_err:
-                            print(f"Direct extraction failed: {extract_err}")
-                    
-                    raise e  # Re-raise the original error if our repair failed
-        else:
-            # For other models use the normal approach
-            return self.client.chat.completions.create(
+            prompt = f"{prompt}{OLLAMA_JSON_INSTRUCTIONS}"
+        return [{"role": "user", "content": prompt}]
+
+    def structured_max_retries(self) -> int:
+        if 'ollama' in self.llm.model:
+            return OLLAMA_STRUCTURED_OUTPUT_MAX_RETRIES
+        return STRUCTURED_OUTPUT_MAX_RETRIES
+
+    def repair_structured_output(self, response_model: type[T], error: Exception) -> T:
+        """Parse the raw output of a failed Ollama instructor call with our JSON repair.
+
+        The output comes from the failed call itself, so the model is not asked
+        again. Errors without any output, like connection errors, and errors of
+        other models are re-raised.
+        """
+        content = completion_text(getattr(error, "last_completion", None))
+        try:
+            if content is None or "ollama" not in self.llm.model:
+                raise error
+            result = parse_structured_output(response_model, content, error=error)
+        except Exception:
+            STRUCTURED_OUTPUT_RESULTS.labels(self.model, "failed").inc()
+            raise
+        STRUCTURED_OUTPUT_RESULTS.labels(self.model, "repaired").inc()
+        return result
+
+    def structured_complete(self, response_model: type[T], prompt: str) -> T:
+        try:
+            result = self.client.chat.completions.create(
                 model=self.llm.model,
-                messages=[{"role": "user", "content": prompt}],
+                messages=self.structured_messages(prompt),
                 response_model=response_model,
+                max_retries=self.structured_max_retries() + 1,
             )
+        except Exception as e:
+            print(f"Instructor parsing failed: {str(e)}")
+            return self.repair_structured_output(response_model, e)
+        STRUCTURED_OUTPUT_RESULTS.labels(self.model, "parsed").inc()
+        return result
+
+    async def acomplete(self, prompt: str) -> CompletionResponse:
+        return await self.llm.acomplete(prompt)
+
+    async def astructured_complete(self, response_model: type[T], prompt: str) -> T:
+        try:
+            result = await self.aclient.chat.completions.create(
+                model=self.llm.model,
+                messages=self.structured_messages(prompt),
+                response_model=response_model,
+                max_retries=self.structured_max_retries() + 1,
+            )
+        except Exception as e:
+            print(f"Instructor parsing failed: {str(e)}")
+            return self.repair_structured_output(response_model, e)
+        STRUCTURED_OUTPUT_RESULTS.labels(self.model, "parsed").inc()
+        return result
+
+
+# Env vars litellm reads credentials and endpoints from
+LLM_ENV_SUFFIXES = ("_API_KEY", "_API_BASE", "_API_VERSION")
+
+llm_registry: dict[str, tuple[int, EveryLLM]] = {}
+
+
+def llm_env_fingerprint() -> int:
+    return hash(
+        tuple(
+            sorted(
+                (key, value)
+                for key, value in os.environ.items()
+                if key.endswith(LLM_ENV_SUFFIXES)
+            )
+        )
+    )
+
+
+def get_llm(model: str) -> EveryLLM:
+    """Shared `EveryLLM` for a resolved model string, as from `get_model_string`.
+
+    Instances are rebuilt when the provider credentials or endpoints in the
+    environment change.
+    """
+    cached = llm_registry.get(model)
+    if cached is not None and cached[0] == llm_env_fingerprint():
+        return cached[1]
+
+    llm = EveryLLM(model=model)
+    # Construction may fill in defaults such as OLLAMA_API_BASE
+    llm_registry[model] = (llm_env_fingerprint(), llm)
+    return llm
+
+
+def create_llm_http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    )
+
+
+def open_llm_clients() -> None:
+    litellm.client_session = httpx.Client(
+        limits=create_llm_http_limits(), timeout=LLM_HTTP_TIMEOUT
+    )
+    litellm.aclient_session = httpx.AsyncClient(
+        limits=create_llm_http_limits(), timeout=LLM_HTTP_TIMEOUT
+    )
+
+
+async def close_llm_clients() -> None:
+    llm_registry.clear()
+    if litellm.client_session is not None:
+        litellm.client_session.close()
+        litellm.client_session = None
+    if litellm.aclient_session is not None:
+        await litellm.aclient_session.aclose()
+        litellm.aclient_session = None
@@ -1,24 +1,34 @@
 import asyncio
-import json
 import os
+import time
 import traceback
+from contextlib import asynccontextmanager
 from typing import Generator
 
 import logfire
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException, Request
-from fastapi.encoders import jsonable_encoder
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from slowapi import Limiter
 from slowapi.errors import RateLimitExceeded
 from slowapi.util import get_ipaddr
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sse_starlette.sse import EventSourceResponse, ServerSentEvent
 
 from backend.agent_search import stream_pro_search_qa
 from backend.chat import stream_qa_objects
 from backend.db.chat import get_chat_history, get_thread
 from backend.db.engine import get_session
+from backend.db.thread_cache import thread_cache
+from backend.db.writer import DB_WRITE_BEHIND_ENABLED, turn_writer
+from backend.llm.base import close_llm_clients, open_llm_clients
+from backend.metrics import (
+    STAGE_METRICS_ENABLED,
+    STREAM_TIMING_EVENT_ENABLED,
+    record_stage,
+    stage_timings,
+)
 from backend.schemas import (
     ChatHistoryResponse,
     ChatRequest,
@@ -26,8 +36,18 @@ from backend.schemas import (
     ErrorStream,
     StreamEvent,
     ThreadResponse,
+    TimingsStream,
+)
+from backend.search.search_service import (
+    close_search_providers,
+    open_search_providers,
+)
+from backend.streaming import (
+    cancel_on_disconnect,
+    coalesce_text_chunks,
+    serialize_event,
 )
-from backend.utils import strtobool
+from backend.utils import DB_ENABLED, strtobool
 from backend.validators import validate_model
 
 load_dotenv()
@@ -39,7 +59,7 @@ def create_error_event(detail: str):
         event=StreamEvent.ERROR,
     )
     return ServerSentEvent(
-        data=json.dumps(jsonable_encoder(obj)),
+        data=serialize_event(obj),
         event=StreamEvent.ERROR,
     )
 
@@ -82,8 +102,20 @@ def configure_middleware(app: FastAPI):
     )
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    open_search_providers()
+    open_llm_clients()
+    if DB_ENABLED and DB_WRITE_BEHIND_ENABLED:
+        turn_writer.start()
+    yield
+    await turn_writer.stop()
+    await close_search_providers()
+    await close_llm_clients()
+
+
 def create_app() -> FastAPI:
-    app = FastAPI()
+    app = FastAPI(lifespan=lifespan)
     configure_middleware(app)
     configure_logging(app, os.getenv("LOGFIRE_TOKEN"))
     configure_rate_limiting(
@@ -100,19 +132,40 @@ app = create_app()
 @app.post("/chat")
 @app.state.limiter.limit("4/min")
 async def chat(
-    chat_request: ChatRequest, request: Request, session: Session = Depends(get_session)
+    chat_request: ChatRequest,
+    request: Request,
+    session: AsyncSession = Depends(get_session),
 ) -> Generator[ChatResponseEvent, None, None]:
     async def generator():
+        start = time.perf_counter()
+        first_token = True
+        # Set before the stream task starts, so its stages record into it
+        timings = {} if STAGE_METRICS_ENABLED and STREAM_TIMING_EVENT_ENABLED else None
+        stage_timings.set(timings)
         try:
             validate_model(chat_request.model)
             stream_fn = (
                 stream_pro_search_qa if chat_request.pro_search else stream_qa_objects
             )
-            async for obj in stream_fn(request=chat_request, session=session):
-                if await request.is_disconnected():
-                    break
-                yield json.dumps(jsonable_encoder(obj))
+            events = cancel_on_disconnect(
+                request,
+                coalesce_text_chunks(stream_fn(request=chat_request, session=session)),
+            )
+            async for obj in events:
+                if first_token and obj.event == StreamEvent.TEXT_CHUNK:
+                    record_stage("ttft", time.perf_counter() - start)
+                    first_token = False
+                yield serialize_event(obj)
                 await asyncio.sleep(0)
+
+            record_stage("request", time.perf_counter() - start)
+            if timings is not None:
+                yield serialize_event(
+                    ChatResponseEvent(
+                        event=StreamEvent.TIMINGS,
+                        data=TimingsStream(timings=timings),
+                    )
+                )
         except Exception as e:
             print(traceback.format_exc())
             yield create_error_event(str(e))
@@ -123,12 +176,17 @@ async def chat(
 
 
 @app.get("/history")
-async def recents(session: Session = Depends(get_session)) -> ChatHistoryResponse:
+async def recents(
+    limit: int = Query(20, ge=1, le=100),
+    cursor: str | None = None,
+    session: AsyncSession = Depends(get_session),
+) -> ChatHistoryResponse:
     DB_ENABLED = strtobool(os.environ.get("DB_ENABLED", "true"))
     if DB_ENABLED:
         try:
-            history = get_chat_history(session=session)
-            return ChatHistoryResponse(snapshots=history)
+            return await get_chat_history(session=session, limit=limit, cursor=cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
     else:
@@ -138,9 +196,37 @@ async def recents(session: Session = Depends(get_session)) -> ChatHistoryRespons
         )
 
 
-@app.get("/thread/{thread_id}")
+@app.get("/thread/{thread_id}", response_model=ThreadResponse)
 async def thread(
-    thread_id: int, session: Session = Depends(get_session)
-) -> ThreadResponse:
-    thread = get_thread(session=session, thread_id=thread_id)
-    return thread
+    thread_id: int,
+    limit: int | None = Query(None, ge=1, le=500),
+    before: int | None = None,
+    session: AsyncSession = Depends(get_session),
+) -> Response:
+    # Turns of this thread still in the write-behind queue are written first
+    await turn_writer.wait_for_thread(thread_id)
+
+    # Full threads are served straight from the cached JSON payload
+    full_thread = limit is None and before is None
+    generation = None
+    if full_thread:
+        payload, generation = await thread_cache.get(thread_id)
+        if payload is not None:
+            return Response(content=payload, media_type="application/json")
+
+    try:
+        thread = await get_thread(
+            session=session, thread_id=thread_id, limit=limit, before=before
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    payload = thread.model_dump_json()
+    if full_thread:
+        await thread_cache.set(thread_id, payload, generation)
+    return Response(content=payload, media_type="application/json")
+
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
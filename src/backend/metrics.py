@@ -0,0 +1,135 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import logfire
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge, Histogram
+
+from backend.utils import strtobool
+
+load_dotenv()
+
+
+STAGE_METRICS_ENABLED = strtobool(os.getenv("STAGE_METRICS_ENABLED", True))
+# Send the stage timings of each request as a final `timings` event
+STREAM_TIMING_EVENT_ENABLED = strtobool(os.getenv("STREAM_TIMING_EVENT_ENABLED", False))
+LOGFIRE_ENABLED = bool(os.getenv("LOGFIRE_TOKEN"))
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+STREAMS_CANCELLED = Counter(
+    "chat_streams_cancelled_total",
+    "Chat streams stopped early because the client went away",
+)
+TASKS_CANCELLED = Counter(
+    "chat_tasks_cancelled_total",
+    "Upstream tasks cancelled because their chat stream stopped early",
+    ["task"],
+)
+STAGE_DURATION = Histogram(
+    "chat_stage_duration_seconds",
+    "Time spent in each stage of a chat request",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+SEARCH_DURATION = Histogram(
+    "search_duration_seconds",
+    "Search latency by provider and the cache tier that answered",
+    ["provider", "tier"],
+    buckets=LATENCY_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total",
+    "Lookups in in-process caches by result: hit, miss or expired",
+    ["cache", "result"],
+)
+CACHE_EVICTIONS = Counter(
+    "cache_evictions_total",
+    "Entries evicted from in-process caches to stay within their limits",
+    ["cache"],
+)
+CACHE_ENTRIES = Gauge(
+    "cache_entries",
+    "Entries held by each in-process cache",
+    ["cache"],
+)
+CACHE_BYTES = Gauge(
+    "cache_size_bytes",
+    "Approximate size of each in-process cache",
+    ["cache"],
+)
+SEARCH_HEDGES = Counter(
+    "search_hedges_total",
+    "Hedged searches by outcome",
+    ["outcome"],
+)
+SEARCH_PROVIDER_STATE = Gauge(
+    "search_provider_circuit_state",
+    "Circuit breaker state of each search provider: 0 closed, 1 half-open, 2 open",
+    ["provider"],
+)
+SEARCH_PROVIDER_IN_FLIGHT = Gauge(
+    "search_provider_in_flight",
+    "Searches currently sent to each provider",
+    ["provider"],
+)
+SEARCH_PROVIDER_REJECTED = Counter(
+    "search_provider_rejected_total",
+    "Searches refused without calling the provider",
+    ["provider", "reason"],
+)
+SEARCH_PROVIDER_FAILURES = Counter(
+    "search_provider_failures_total",
+    "Failed provider calls",
+    ["provider", "reason"],
+)
+STRUCTURED_OUTPUT_ATTEMPTS = Counter(
+    "llm_structured_output_attempts_total",
+    "Requests made for structured outputs, including re-asks",
+    ["model"],
+)
+STRUCTURED_OUTPUT_RESULTS = Counter(
+    "llm_structured_outputs_total",
+    "Structured outputs by how they were obtained: parsed, repaired or failed",
+    ["model", "outcome"],
+)
+DB_TURN_WRITES = Counter(
+    "db_turn_writes_total",
+    "Chat turns from the write-behind queue by result: written, retried, failed "
+    "or dropped",
+    ["result"],
+)
+
+# Durations of the current request by stage, when they are sent to the client
+stage_timings: ContextVar[dict[str, list[float]] | None] = ContextVar(
+    "stage_timings", default=None
+)
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    if not STAGE_METRICS_ENABLED:
+        return
+    STAGE_DURATION.labels(stage).observe(seconds)
+    timings = stage_timings.get()
+    if timings is not None:
+        timings.setdefault(stage, []).append(round(seconds, 4))
+
+
+@contextmanager
+def timed(stage: str):
+    """Time a block as `stage`, and trace it as a span when Logfire is on."""
+    if not STAGE_METRICS_ENABLED:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        if LOGFIRE_ENABLED:
+            with logfire.span("chat {stage}", stage=stage):
+                yield
+        else:
+            yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
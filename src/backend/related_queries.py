@@ -1,4 +1,6 @@
+from backend.context import CONTEXT_TOKENS_RELATED, pack_search_results
 from backend.llm.base import BaseLLM
+from backend.metrics import timed
 from backend.prompts import RELATED_QUESTION_PROMPT
 from backend.schemas import RelatedQueries, SearchResult
 
@@ -6,10 +8,15 @@ from backend.schemas import RelatedQueries, SearchResult
 async def generate_related_queries(
     query: str, search_results: list[SearchResult], llm: BaseLLM
 ) -> list[str]:
-    context = "\n\n".join([f"{str(result)}" for result in search_results])
-    context = context[:4000]
-    related = llm.structured_complete(
-        RelatedQueries, RELATED_QUESTION_PROMPT.format(query=query, context=context)
+    context = "\n\n".join(
+        str(result)
+        for result in pack_search_results(
+            search_results, llm.model, CONTEXT_TOKENS_RELATED
+        )
     )
+    with timed("related_queries"):
+        related = await llm.astructured_complete(
+            RelatedQueries, RELATED_QUESTION_PROMPT.format(query=query, context=context)
+        )
 
     return [query.lower().replace("?", "") for query in related.related_questions]
@@ -3,7 +3,7 @@
 import os
 from datetime import datetime
 from enum import Enum
-from typing import List, Union
+from typing import Annotated, List, Literal, Union
 
 from dotenv import load_dotenv
 from logfire.integrations.pydantic import PluginSettings
@@ -84,6 +84,7 @@ class StreamEvent(str, Enum):
     STREAM_END = "stream-end"
     FINAL_RESPONSE = "final-response"
     ERROR = "error"
+    TIMINGS = "timings"
 
     # Agent Events
     AGENT_QUERY_PLAN = "agent-query-plan"
@@ -98,82 +99,96 @@ class ChatObject(BaseModel):
 
 
 class BeginStream(ChatObject, plugin_settings=record_all):
-    event_type: StreamEvent = StreamEvent.BEGIN_STREAM
+    event_type: Literal[StreamEvent.BEGIN_STREAM] = StreamEvent.BEGIN_STREAM
     query: str
 
 
 class SearchResultStream(ChatObject, plugin_settings=record_all):
-    event_type: StreamEvent = StreamEvent.SEARCH_RESULTS
+    event_type: Literal[StreamEvent.SEARCH_RESULTS] = StreamEvent.SEARCH_RESULTS
     results: List[SearchResult] = Field(default_factory=list)
     images: List[str] = Field(default_factory=list)
 
 
 class TextChunkStream(ChatObject):
-    event_type: StreamEvent = StreamEvent.TEXT_CHUNK
+    event_type: Literal[StreamEvent.TEXT_CHUNK] = StreamEvent.TEXT_CHUNK
     text: str
 
 
 class RelatedQueriesStream(ChatObject, plugin_settings=record_all):
-    event_type: StreamEvent = StreamEvent.RELATED_QUERIES
+    event_type: Literal[StreamEvent.RELATED_QUERIES] = StreamEvent.RELATED_QUERIES
     related_queries: List[str] = Field(default_factory=list)
 
 
 class StreamEndStream(ChatObject, plugin_settings=record_all):
     thread_id: int | None = None
-    event_type: StreamEvent = StreamEvent.STREAM_END
+    event_type: Literal[StreamEvent.STREAM_END] = StreamEvent.STREAM_END
 
 
 class FinalResponseStream(ChatObject, plugin_settings=record_all):
-    event_type: StreamEvent = StreamEvent.FINAL_RESPONSE
+    event_type: Literal[StreamEvent.FINAL_RESPONSE] = StreamEvent.FINAL_RESPONSE
     message: str
 
 
 class ErrorStream(ChatObject, plugin_settings=record_all):
-    event_type: StreamEvent = StreamEvent.ERROR
+    event_type: Literal[StreamEvent.ERROR] = StreamEvent.ERROR
     detail: str
 
 
+class TimingsStream(ChatObject):
+    event_type: Literal[StreamEvent.TIMINGS] = StreamEvent.TIMINGS
+    # Seconds spent in each stage, once per time the stage ran
+    timings: dict[str, list[float]] = Field(default_factory=dict)
+
+
 class AgentQueryPlanStream(ChatObject, plugin_settings=record_all):
-    event_type: StreamEvent = StreamEvent.AGENT_QUERY_PLAN
+    event_type: Literal[StreamEvent.AGENT_QUERY_PLAN] = StreamEvent.AGENT_QUERY_PLAN
     steps: List[str] = Field(default_factory=list)
 
 
 class AgentSearchQueriesStream(ChatObject, plugin_settings=record_all):
-    event_type: StreamEvent = StreamEvent.AGENT_SEARCH_QUERIES
+    event_type: Literal[StreamEvent.AGENT_SEARCH_QUERIES] = (
+        StreamEvent.AGENT_SEARCH_QUERIES
+    )
     step_number: int
     queries: List[str] = Field(default_factory=list)
 
 
 class AgentReadResultsStream(ChatObject, plugin_settings=record_all):
-    event_type: StreamEvent = StreamEvent.AGENT_READ_RESULTS
+    event_type: Literal[StreamEvent.AGENT_READ_RESULTS] = StreamEvent.AGENT_READ_RESULTS
     step_number: int
     results: List[SearchResult] = Field(default_factory=list)
 
 
 class AgentSearchFullResponseStream(ChatObject, plugin_settings=record_all):
-    event_type: StreamEvent = StreamEvent.AGENT_FULL_RESPONSE
+    event_type: Literal[StreamEvent.AGENT_FULL_RESPONSE] = (
+        StreamEvent.AGENT_FULL_RESPONSE
+    )
     response: AgentSearchFullResponse
 
 
 class AgentFinishStream(ChatObject, plugin_settings=record_all):
-    event_type: StreamEvent = StreamEvent.AGENT_FINISH
+    event_type: Literal[StreamEvent.AGENT_FINISH] = StreamEvent.AGENT_FINISH
 
 
 class ChatResponseEvent(BaseModel):
     event: StreamEvent
-    data: Union[
-        BeginStream,
-        SearchResultStream,
-        TextChunkStream,
-        RelatedQueriesStream,
-        StreamEndStream,
-        FinalResponseStream,
-        ErrorStream,
-        AgentQueryPlanStream,
-        AgentSearchQueriesStream,
-        AgentReadResultsStream,
-        AgentFinishStream,
-        AgentSearchFullResponseStream,
+    data: Annotated[
+        Union[
+            BeginStream,
+            SearchResultStream,
+            TextChunkStream,
+            RelatedQueriesStream,
+            StreamEndStream,
+            FinalResponseStream,
+            ErrorStream,
+            TimingsStream,
+            AgentQueryPlanStream,
+            AgentSearchQueriesStream,
+            AgentReadResultsStream,
+            AgentFinishStream,
+            AgentSearchFullResponseStream,
+        ],
+        Field(discriminator="event_type"),
     ]
 
 
@@ -187,6 +202,8 @@ class ChatSnapshot(BaseModel):
 
 class ChatHistoryResponse(BaseModel):
     snapshots: List[ChatSnapshot] = Field(default_factory=list)
+    # Pass back as `cursor` to fetch the next page, None on the last page
+    next_cursor: str | None = None
 
 
 class ChatMessage(BaseModel):
@@ -202,3 +219,5 @@ class ChatMessage(BaseModel):
 class ThreadResponse(BaseModel):
     thread_id: int
     messages: List[ChatMessage] = Field(default_factory=list)
+    # Pass back as `before` to fetch older messages, None when there are none
+    next_before: int | None = None
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import re
+import time
+import unicodedata
+from typing import Awaitable, Callable
+
+import redis.asyncio as redis
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+from backend.cache import LRUCache
+from backend.schemas import SearchResponse
+
+load_dotenv()
+
+
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 7200))
+# How long past its TTL an entry may still be served while it is refreshed
+SEARCH_CACHE_STALE_TTL = int(os.getenv("SEARCH_CACHE_STALE_TTL", 0))
+# In-process tier in front of Redis, set either limit to 0 to disable it
+SEARCH_L1_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_L1_CACHE_MAX_ENTRIES", 1024))
+SEARCH_L1_CACHE_MAX_BYTES = int(
+    os.getenv("SEARCH_L1_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+)
+
+
+def normalize_query(query: str) -> str:
+    """Fold case, punctuation and whitespace so equivalent queries share a key."""
+    query = unicodedata.normalize("NFKC", query).casefold()
+    query = re.sub(r"[^\w\s]", " ", query)
+    return " ".join(query.split())
+
+
+def search_cache_key(provider: str, query: str) -> str:
+    return f"search:{provider}:{normalize_query(query)}"
+
+
+class CachedSearchResponse(BaseModel):
+    fetched_at: float
+    response: SearchResponse
+
+
+class SearchCache:
+    """Two-tier search cache with single-flight fetching.
+
+    An in-process LRU of validated responses sits in front of Redis, and works
+    on its own when Redis is not configured. Concurrent lookups of the same key
+    share one provider call, and entries past their TTL are served for up to
+    `stale_ttl` seconds while a single background refresh replaces them.
+    """
+
+    def __init__(
+        self,
+        redis_client: redis.Redis | None,
+        ttl: int = SEARCH_CACHE_TTL,
+        stale_ttl: int = SEARCH_CACHE_STALE_TTL,
+    ):
+        self.redis_client = redis_client
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.local_cache: LRUCache[CachedSearchResponse] = LRUCache(
+            name="search",
+            max_entries=SEARCH_L1_CACHE_MAX_ENTRIES,
+            max_bytes=SEARCH_L1_CACHE_MAX_BYTES,
+            ttl=ttl + stale_ttl,
+        )
+        self.in_flight: dict[str, asyncio.Task[SearchResponse]] = {}
+        # Requests waiting on each fetch, which is cancelled when they all leave
+        self.waiters: dict[asyncio.Task[SearchResponse], int] = {}
+        # Background refreshes of stale entries, which run without waiters
+        self.refreshes: set[asyncio.Task[SearchResponse]] = set()
+
+    async def get_or_fetch(
+        self, key: str, fetch: Callable[[], Awaitable[SearchResponse]]
+    ) -> tuple[SearchResponse, str]:
+        """Return the response and the tier that answered it.
+
+        The tier is "memory", "redis", "stale" or "provider".
+        """
+        cached, tier = await self.read(key)
+        if cached is not None and not self.expired(cached):
+            if time.time() - cached.fetched_at > self.ttl:
+                self.refreshes.add(self.fetch_once(key, fetch))
+                tier = "stale"
+            return cached.response, tier
+
+        return await self.wait_for_fetch(key, fetch), "provider"
+
+    async def wait_for_fetch(
+        self, key: str, fetch: Callable[[], Awaitable[SearchResponse]]
+    ) -> SearchResponse:
+        """Wait on the shared fetch of `key`, cancelling it if every waiter leaves.
+
+        The fetch is shielded so one cancelled request can't fail the others
+        sharing it, but once the last one is gone the provider call is stopped.
+        """
+        task = self.fetch_once(key, fetch)
+        self.waiters[task] = self.waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self.waiters[task] -= 1
+            if not self.waiters[task]:
+                del self.waiters[task]
+                if not task.done() and task not in self.refreshes:
+                    task.cancel()
+
+    def expired(self, cached: CachedSearchResponse) -> bool:
+        """Past its TTL and the time it may be served stale."""
+        return time.time() - cached.fetched_at > self.ttl + self.stale_ttl
+
+    def lifetime(self, cached: CachedSearchResponse) -> float:
+        """Seconds until `cached` expires, counted from when it was fetched."""
+        return self.ttl + self.stale_ttl - (time.time() - cached.fetched_at)
+
+    def fetch_once(
+        self, key: str, fetch: Callable[[], Awaitable[SearchResponse]]
+    ) -> asyncio.Task[SearchResponse]:
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self.fetch_and_store(key, fetch))
+            self.in_flight[key] = task
+            task.add_done_callback(lambda task: self.fetch_done(key, task))
+        return task
+
+    def fetch_done(self, key: str, task: asyncio.Task[SearchResponse]) -> None:
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        self.refreshes.discard(task)
+        # Background refreshes have nobody awaiting them, so report their errors here
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error fetching search results: {task.exception()}")
+
+    async def fetch_and_store(
+        self, key: str, fetch: Callable[[], Awaitable[SearchResponse]]
+    ) -> SearchResponse:
+        response = await fetch()
+        await self.write(key, response)
+        return response
+
+    async def read(self, key: str) -> tuple[CachedSearchResponse | None, str]:
+        if (cached := self.local_cache.get(key)) is not None:
+            return cached, "memory"
+
+        if self.redis_client is None:
+            return None, "redis"
+        try:
+            payload = await self.redis_client.get(key)
+            if payload is None:
+                return None, "redis"
+            cached = CachedSearchResponse.model_validate_json(payload)
+        except Exception as e:
+            print(f"Error reading search cache: {e}")
+            return None, "redis"
+
+        self.local_cache.set(key, cached, size=len(payload), ttl=self.lifetime(cached))
+        return cached, "redis"
+
+    async def write(self, key: str, response: SearchResponse) -> None:
+        cached = CachedSearchResponse(fetched_at=time.time(), response=response)
+        payload = cached.model_dump_json()
+        self.local_cache.set(key, cached, size=len(payload))
+
+        if self.redis_client is None:
+            return
+        try:
+            await self.redis_client.set(key, payload, ex=self.ttl + self.stale_ttl)
+        except Exception as e:
+            print(f"Error writing search cache: {e}")
@@ -0,0 +1,59 @@
+import os
+
+from dotenv import load_dotenv
+
+from backend.schemas import SearchResult
+from backend.search.cache import normalize_query
+from backend.utils import canonicalize_url
+
+load_dotenv()
+
+
+# Larger values flatten the gap between the top ranks of each list
+SEARCH_RRF_K = int(os.getenv("SEARCH_RRF_K", 60))
+# Results kept after fusing the results of several queries
+SEARCH_FUSION_TOP_K = int(os.getenv("SEARCH_FUSION_TOP_K", 12))
+
+
+def url_identity(url: str) -> str:
+    """Canonical URL without its scheme or `www.`, so those variants match."""
+    url = canonicalize_url(url).split("://", 1)[-1]
+    return url.removeprefix("www.")
+
+
+def fuse_search_results(
+    result_lists: list[list[SearchResult]],
+    top_k: int | None = SEARCH_FUSION_TOP_K,
+    k: int = SEARCH_RRF_K,
+) -> list[SearchResult]:
+    """Merge the ranked results of several queries with reciprocal rank fusion.
+
+    A page scores 1 / (k + rank) in every list it appears in, matched across
+    lists by canonical URL, and every result of every list counts. Distinct
+    snippets of the same page are merged. Ties keep the order in which pages
+    were first seen, so the same inputs always give the same top `top_k`.
+    """
+    scores: dict[str, float] = {}
+    merged: dict[str, SearchResult] = {}
+    snippets: dict[str, dict[str, str]] = {}
+
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            key = url_identity(result.url)
+            scores[key] = scores.get(key, 0.0) + 1 / (k + rank)
+            if key not in merged:
+                merged[key] = result.model_copy(
+                    update={"url": canonicalize_url(result.url)}
+                )
+                snippets[key] = {}
+            elif result.url.startswith("https:"):
+                # Link to the secure variant when any list has it
+                merged[key].url = canonicalize_url(result.url)
+            snippets[key].setdefault(normalize_query(result.content), result.content)
+
+    for key, contents in snippets.items():
+        if len(contents) > 1:
+            merged[key].content = "\n".join(contents.values())
+
+    ranked = sorted(scores, key=scores.__getitem__, reverse=True)
+    return [merged[key] for key in ranked[:top_k]]
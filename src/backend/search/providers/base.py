@@ -1,9 +1,59 @@
+import os
 from abc import ABC, abstractmethod
+from importlib.util import find_spec
+
+import httpx
+from dotenv import load_dotenv
 
 from backend.schemas import SearchResponse
+from backend.utils import strtobool
+
+load_dotenv()
+
+
+SEARCH_HTTP_MAX_CONNECTIONS = int(os.getenv("SEARCH_HTTP_MAX_CONNECTIONS", 100))
+SEARCH_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("SEARCH_HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+SEARCH_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("SEARCH_HTTP_KEEPALIVE_EXPIRY", 30))
+SEARCH_HTTP_TIMEOUT = float(os.getenv("SEARCH_HTTP_TIMEOUT", 10))
+SEARCH_HTTP_CONNECT_TIMEOUT = float(os.getenv("SEARCH_HTTP_CONNECT_TIMEOUT", 3))
+# Results asked of the provider per search, reranked down before prompting
+SEARCH_NUM_RESULTS = int(os.getenv("SEARCH_NUM_RESULTS", 10))
+# HTTP/2 needs the optional `h2` package (httpx[http2])
+SEARCH_HTTP2_ENABLED = (
+    strtobool(os.getenv("SEARCH_HTTP2_ENABLED", True)) and find_spec("h2") is not None
+)
+
+
+def create_http_client(**kwargs) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=SEARCH_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=SEARCH_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=SEARCH_HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(SEARCH_HTTP_TIMEOUT, connect=SEARCH_HTTP_CONNECT_TIMEOUT),
+        http2=SEARCH_HTTP2_ENABLED,
+        **kwargs,
+    )
 
 
 class SearchProvider(ABC):
+    _client: httpx.AsyncClient | None = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """The long-lived, pooled HTTP client shared by every search call."""
+        if self._client is None or self._client.is_closed:
+            self._client = create_http_client()
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
     @abstractmethod
     async def search(self, query: str) -> SearchResponse:
         pass
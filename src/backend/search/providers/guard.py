@@ -0,0 +1,241 @@
+import asyncio
+import os
+import time
+from collections import deque
+from enum import Enum
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from backend.metrics import (
+    SEARCH_PROVIDER_FAILURES,
+    SEARCH_PROVIDER_IN_FLIGHT,
+    SEARCH_PROVIDER_REJECTED,
+    SEARCH_PROVIDER_STATE,
+)
+from backend.schemas import SearchResponse
+from backend.search.providers.base import SEARCH_HTTP_TIMEOUT, SearchProvider
+from backend.utils import strtobool
+
+load_dotenv()
+
+
+SEARCH_GUARD_ENABLED = strtobool(os.getenv("SEARCH_GUARD_ENABLED", True))
+
+
+def provider_setting(provider: str, name: str, default: float) -> float:
+    """`SEARCH_<PROVIDER>_<NAME>`, falling back to `SEARCH_<NAME>`."""
+    value = os.getenv(f"SEARCH_{provider.upper()}_{name}") or os.getenv(
+        f"SEARCH_{name}"
+    )
+    return float(value) if value else default
+
+
+class GuardSettings(BaseModel):
+    # Searches sent to the provider at once, the rest wait their turn
+    max_in_flight: int = 16
+    # Sustained searches per second allowed by the provider's quota, 0 is unlimited
+    rate_limit: float = 0
+    rate_burst: int = 10
+    # Longest a search waits for a slot or a token before giving up
+    queue_timeout: float = 10
+    # The timeout is this multiple of the recent p99 latency, within the bounds
+    timeout_multiplier: float = 3
+    min_timeout: float = 2
+    max_timeout: float = SEARCH_HTTP_TIMEOUT
+    # Consecutive failures that open the circuit, and how long it stays open
+    failure_threshold: int = 5
+    reset_timeout: float = 30
+    half_open_probes: int = 1
+
+    @classmethod
+    def from_env(cls, provider: str) -> "GuardSettings":
+        defaults = cls()
+        return cls(
+            **{
+                name: provider_setting(provider, name.upper(), getattr(defaults, name))
+                for name in cls.model_fields
+            }
+        )
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average, `burst` at once.
+
+    Waiters are served in arrival order.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class CircuitState(int, Enum):
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+
+class CircuitBreaker:
+    """Fails fast after repeated failures, then lets probes test for recovery."""
+
+    def __init__(
+        self, failure_threshold: int, reset_timeout: float, half_open_probes: int
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+
+    def allow(self) -> bool:
+        if (
+            self.state == CircuitState.OPEN
+            and time.monotonic() - self.opened_at >= self.reset_timeout
+        ):
+            self.state = CircuitState.HALF_OPEN
+            self.probes = 0
+        if self.state == CircuitState.CLOSED:
+            return True
+        if self.state == CircuitState.HALF_OPEN and self.probes < self.half_open_probes:
+            self.probes += 1
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if (
+            self.state == CircuitState.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            self.state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_cancelled(self) -> None:
+        """Give back the probe of a search that was abandoned before it finished."""
+        if self.state == CircuitState.HALF_OPEN:
+            self.probes = max(self.probes - 1, 0)
+
+
+class GuardedSearchProvider(SearchProvider):
+    """Concurrency cap, rate limit, adaptive timeout and circuit breaker for a provider.
+
+    Bursts queue for a slot and a rate limit token instead of hitting the
+    provider at once. Each search times out at a multiple of the provider's
+    recent p99 latency, and after repeated failures searches fail fast until
+    a probe succeeds.
+    """
+
+    def __init__(self, name: str, provider: SearchProvider, settings: GuardSettings):
+        self.name = name
+        self.provider = provider
+        self.settings = settings
+        self.slots = asyncio.Semaphore(settings.max_in_flight)
+        self.bucket = (
+            TokenBucket(settings.rate_limit, settings.rate_burst)
+            if settings.rate_limit > 0
+            else None
+        )
+        self.breaker = CircuitBreaker(
+            settings.failure_threshold,
+            settings.reset_timeout,
+            settings.half_open_probes,
+        )
+        self.latencies: deque[float] = deque(maxlen=200)
+        SEARCH_PROVIDER_STATE.labels(name).set(self.breaker.state)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self.provider.client
+
+    async def aclose(self) -> None:
+        await self.provider.aclose()
+
+    def timeout(self) -> float:
+        if len(self.latencies) < 20:
+            return self.settings.max_timeout
+        latencies = sorted(self.latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return min(
+            max(p99 * self.settings.timeout_multiplier, self.settings.min_timeout),
+            self.settings.max_timeout,
+        )
+
+    def reject(self, reason: str, detail: str) -> HTTPException:
+        SEARCH_PROVIDER_REJECTED.labels(self.name, reason).inc()
+        return HTTPException(status_code=503, detail=detail)
+
+    async def search(self, query: str) -> SearchResponse:
+        if not self.breaker.allow():
+            raise self.reject(
+                "circuit_open",
+                f"The {self.name} search provider is unavailable, please try again shortly.",
+            )
+        SEARCH_PROVIDER_STATE.labels(self.name).set(self.breaker.state)
+
+        try:
+            try:
+                async with asyncio.timeout(self.settings.queue_timeout):
+                    await self.slots.acquire()
+                    try:
+                        if self.bucket is not None:
+                            await self.bucket.acquire()
+                    except BaseException:
+                        self.slots.release()
+                        raise
+            except TimeoutError:
+                self.breaker.record_cancelled()
+                raise self.reject(
+                    "queue_timeout",
+                    f"The {self.name} search provider is busy, please try again shortly.",
+                )
+
+            SEARCH_PROVIDER_IN_FLIGHT.labels(self.name).inc()
+            start = time.perf_counter()
+            try:
+                async with asyncio.timeout(self.timeout()):
+                    response = await self.provider.search(query)
+            except TimeoutError:
+                SEARCH_PROVIDER_FAILURES.labels(self.name, "timeout").inc()
+                self.breaker.record_failure()
+                raise
+            except Exception:
+                SEARCH_PROVIDER_FAILURES.labels(self.name, "error").inc()
+                self.breaker.record_failure()
+                raise
+            else:
+                self.latencies.append(time.perf_counter() - start)
+                self.breaker.record_success()
+            finally:
+                SEARCH_PROVIDER_IN_FLIGHT.labels(self.name).dec()
+                self.slots.release()
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+        finally:
+            SEARCH_PROVIDER_STATE.labels(self.name).set(self.breaker.state)
+        return response
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+import httpx
+from dotenv import load_dotenv
+
+from backend.metrics import SEARCH_HEDGES
+from backend.schemas import SearchResponse
+from backend.search.providers.base import SearchProvider
+
+load_dotenv()
+
+
+# Percentile of recent primary latencies to wait for before hedging
+SEARCH_HEDGE_PERCENTILE = float(os.getenv("SEARCH_HEDGE_PERCENTILE", 90))
+# Bounds on the hedge delay, in seconds
+SEARCH_HEDGE_MIN_DELAY = float(os.getenv("SEARCH_HEDGE_MIN_DELAY", 0.1))
+SEARCH_HEDGE_MAX_DELAY = float(os.getenv("SEARCH_HEDGE_MAX_DELAY", 3))
+# Number of recent primary latencies the delay is computed from
+SEARCH_HEDGE_WINDOW = int(os.getenv("SEARCH_HEDGE_WINDOW", 200))
+# Samples needed before the percentile is trusted over the max delay
+SEARCH_HEDGE_MIN_SAMPLES = 20
+
+
+class HedgedSearchProvider(SearchProvider):
+    """Send a search to a backup provider when the primary is slow to answer.
+
+    The backup is only queried once the primary has taken longer than a recent
+    percentile of its own latency, so at the 90th percentile roughly one search
+    in ten costs a second call. Whichever provider answers first wins and the
+    other call is cancelled. A failing primary hands over to the backup at once.
+    """
+
+    def __init__(
+        self,
+        primary: SearchProvider,
+        backup: SearchProvider,
+        percentile: float = SEARCH_HEDGE_PERCENTILE,
+        min_delay: float = SEARCH_HEDGE_MIN_DELAY,
+        max_delay: float = SEARCH_HEDGE_MAX_DELAY,
+        window: int = SEARCH_HEDGE_WINDOW,
+    ):
+        self.primary = primary
+        self.backup = backup
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.latencies: deque[float] = deque(maxlen=window)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        self.backup.client
+        return self.primary.client
+
+    async def aclose(self) -> None:
+        await self.primary.aclose()
+        await self.backup.aclose()
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < SEARCH_HEDGE_MIN_SAMPLES:
+            return self.max_delay
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100))
+        return min(max(latencies[index], self.min_delay), self.max_delay)
+
+    async def search(self, query: str) -> SearchResponse:
+        start = time.perf_counter()
+        primary = asyncio.create_task(self.primary.search(query))
+        backup: asyncio.Task[SearchResponse] | None = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_delay())
+            if done and primary.exception() is None:
+                self.latencies.append(time.perf_counter() - start)
+                SEARCH_HEDGES.labels("not_hedged").inc()
+                return primary.result()
+
+            backup = asyncio.create_task(self.backup.search(query))
+            pending = {primary, backup}
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is not None:
+                        continue
+                    if task is primary:
+                        self.latencies.append(time.perf_counter() - start)
+                        SEARCH_HEDGES.labels("primary_won").inc()
+                    else:
+                        # The primary's latency is at least this, keep it as a
+                        # sample so a slow primary raises the delay
+                        if not primary.done():
+                            self.latencies.append(time.perf_counter() - start)
+                        SEARCH_HEDGES.labels("backup_won").inc()
+                    return task.result()
+
+            SEARCH_HEDGES.labels("failed").inc()
+            # Both failed, report the primary's error
+            return primary.result()
+        finally:
+            for task in (primary, backup):
+                if task is not None and not task.done():
+                    task.cancel()
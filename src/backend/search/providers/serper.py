@@ -3,7 +3,7 @@ import asyncio
 import httpx
 
 from backend.schemas import SearchResponse, SearchResult
-from backend.search.providers.base import SearchProvider
+from backend.search.providers.base import SEARCH_NUM_RESULTS, SearchProvider
 
 
 class SerperSearchProvider(SearchProvider):
@@ -15,16 +15,18 @@ class SerperSearchProvider(SearchProvider):
         }
 
     async def search(self, query: str) -> SearchResponse:
-        async with httpx.AsyncClient() as client:
-            link_results, image_results = await asyncio.gather(
-                self.get_link_results(client, query),
-                self.get_image_results(client, query),
-            )
+        link_results, image_results = await asyncio.gather(
+            self.get_link_results(self.client, query),
+            self.get_image_results(self.client, query),
+        )
 
         return SearchResponse(results=link_results, images=image_results)
 
     async def get_link_results(
-        self, client: httpx.AsyncClient, query: str, num_results: int = 6
+        self,
+        client: httpx.AsyncClient,
+        query: str,
+        num_results: int = SEARCH_NUM_RESULTS,
     ) -> list[SearchResult]:
         response = await client.get(
             f"{self.host}/search",
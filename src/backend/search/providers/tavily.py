@@ -1,21 +1,25 @@
-from tavily import TavilyClient
-
 from backend.schemas import SearchResponse, SearchResult
-from backend.search.providers.base import SearchProvider
+from backend.search.providers.base import SEARCH_NUM_RESULTS, SearchProvider
 
 
 class TavilySearchProvider(SearchProvider):
     def __init__(self, api_key: str):
+        self.host = "https://api.tavily.com"
         self.api_key = api_key
-        self.tavily = TavilyClient(api_key=self.api_key)
 
     async def search(self, query: str) -> SearchResponse:
-        response = self.tavily.search(
-            query=query,
-            search_depth="basic",
-            max_results=6,
-            include_images=True,
+        response = await self.client.post(
+            f"{self.host}/search",
+            json={
+                "api_key": self.api_key,
+                "query": query,
+                "search_depth": "basic",
+                "max_results": SEARCH_NUM_RESULTS,
+                "include_images": True,
+            },
         )
+        response.raise_for_status()
+        response = response.json()
 
         if response is None:
             raise ValueError("No response from Tavily")
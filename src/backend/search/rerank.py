@@ -0,0 +1,73 @@
+import math
+import os
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from backend.schemas import SearchResult
+from backend.search.cache import normalize_query
+from backend.utils import strtobool
+
+load_dotenv()
+
+
+SEARCH_RERANK_ENABLED = strtobool(os.getenv("SEARCH_RERANK_ENABLED", True))
+# Results kept for the prompt after reranking
+SEARCH_RERANK_TOP_K = int(os.getenv("SEARCH_RERANK_TOP_K", 6))
+
+# Term frequency saturation and document length normalization
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> list[str]:
+    return normalize_query(text).split()
+
+
+def bm25_scores(query: str, documents: list[str]) -> list[float]:
+    """BM25 score of each document for `query`, with the documents as the corpus."""
+    query_terms = set(tokenize(query))
+    tokenized = [tokenize(document) for document in documents]
+    if not query_terms or not tokenized:
+        return [0.0] * len(documents)
+
+    average_length = sum(map(len, tokenized)) / len(tokenized) or 1
+    document_frequency = Counter(
+        term for terms in tokenized for term in set(terms) & query_terms
+    )
+    idf = {
+        term: math.log(1 + (len(tokenized) - count + 0.5) / (count + 0.5))
+        for term, count in document_frequency.items()
+    }
+
+    scores = []
+    for terms in tokenized:
+        term_frequency = Counter(term for term in terms if term in idf)
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * len(terms) / average_length)
+        scores.append(
+            sum(
+                idf[term] * count * (BM25_K1 + 1) / (count + length_norm)
+                for term, count in term_frequency.items()
+            )
+        )
+    return scores
+
+
+def rerank_search_results(
+    query: str,
+    search_results: list[SearchResult],
+    top_k: int | None = SEARCH_RERANK_TOP_K,
+) -> list[SearchResult]:
+    """Order results by BM25 relevance of their title and snippet to `query`.
+
+    Equally scored results keep their incoming order. With reranking disabled
+    the incoming order is kept and only cut to `top_k`.
+    """
+    if not SEARCH_RERANK_ENABLED or len(search_results) < 2:
+        return search_results[:top_k]
+
+    scores = bm25_scores(
+        query, [f"{result.title} {result.content}" for result in search_results]
+    )
+    ranked = sorted(range(len(search_results)), key=scores.__getitem__, reverse=True)
+    return [search_results[i] for i in ranked[:top_k]]
@@ -1,13 +1,22 @@
-import json
 import os
+import time
+from typing import Callable
 
-import redis
 from dotenv import load_dotenv
 from fastapi import HTTPException
 
+from backend.cache import redis_client
+from backend.metrics import SEARCH_DURATION, STAGE_METRICS_ENABLED
 from backend.schemas import SearchResponse
+from backend.search.cache import SearchCache, search_cache_key
 from backend.search.providers.base import SearchProvider
 from backend.search.providers.bing import BingSearchProvider
+from backend.search.providers.guard import (
+    SEARCH_GUARD_ENABLED,
+    GuardedSearchProvider,
+    GuardSettings,
+)
+from backend.search.providers.hedged import HedgedSearchProvider
 from backend.search.providers.searxng import SearxngSearchProvider
 from backend.search.providers.serper import SerperSearchProvider
 from backend.search.providers.tavily import TavilySearchProvider
@@ -15,8 +24,14 @@ from backend.search.providers.tavily import TavilySearchProvider
 load_dotenv()
 
 
-redis_url = os.getenv("REDIS_URL")
-redis_client = redis.Redis.from_url(redis_url) if redis_url else None
+# Backup provider raced against SEARCH_PROVIDER when it is slow, unset disables
+SEARCH_HEDGE_PROVIDER = os.getenv("SEARCH_HEDGE_PROVIDER", "")
+
+search_cache = SearchCache(redis_client)
+
+# Providers outside the built-in ones, by SEARCH_PROVIDER name. They are
+# guarded and hedged like the built-in ones.
+search_provider_factories: dict[str, Callable[[], SearchProvider]] = {}
 
 
 def get_searxng_base_url():
@@ -59,9 +74,16 @@ def get_bing_api_key():
     return bing_api_key
 
 
-def get_search_provider() -> SearchProvider:
-    search_provider = os.getenv("SEARCH_PROVIDER", "searxng")
+def create_search_provider(search_provider: str) -> SearchProvider:
+    provider = create_unguarded_search_provider(search_provider)
+    if not SEARCH_GUARD_ENABLED:
+        return provider
+    return GuardedSearchProvider(
+        search_provider, provider, GuardSettings.from_env(search_provider)
+    )
+
 
+def create_unguarded_search_provider(search_provider: str) -> SearchProvider:
     match search_provider:
         case "searxng":
             searxng_base_url = get_searxng_base_url()
@@ -75,6 +97,8 @@ def get_search_provider() -> SearchProvider:
         case "bing":
             bing_api_key = get_bing_api_key()
             return BingSearchProvider(bing_api_key)
+        case _ if search_provider in search_provider_factories:
+            return search_provider_factories[search_provider]()
         case _:
             raise HTTPException(
                 status_code=500,
@@ -82,21 +106,57 @@ def get_search_provider() -> SearchProvider:
             )
 
 
-async def perform_search(query: str) -> SearchResponse:
-    search_provider = get_search_provider()
+# Providers are app-scoped so their pooled HTTP clients are reused across requests
+search_providers: dict[str, SearchProvider] = {}
+
+
+def get_search_provider() -> SearchProvider:
+    search_provider = os.getenv("SEARCH_PROVIDER", "searxng")
+    if search_provider not in search_providers:
+        search_providers[search_provider] = create_search_provider(search_provider)
+    if not SEARCH_HEDGE_PROVIDER or SEARCH_HEDGE_PROVIDER == search_provider:
+        return search_providers[search_provider]
+
+    hedged = f"{search_provider}+{SEARCH_HEDGE_PROVIDER}"
+    if hedged not in search_providers:
+        search_providers[hedged] = HedgedSearchProvider(
+            primary=search_providers[search_provider],
+            backup=create_search_provider(SEARCH_HEDGE_PROVIDER),
+        )
+    return search_providers[hedged]
+
 
+def open_search_providers():
+    """Create the configured provider and its HTTP client ahead of the first request."""
     try:
-        cache_key = f"search:{query}"
-        if redis_client and (cached_results := redis_client.get(cache_key)):
-            cached_json = json.loads(json.loads(cached_results.decode("utf-8")))  # type: ignore
-            return SearchResponse(**cached_json)
+        get_search_provider().client
+    except HTTPException as e:
+        print(f"Search provider is not configured: {e.detail}")
+
+
+async def close_search_providers():
+    for provider in search_providers.values():
+        await provider.aclose()
+    search_providers.clear()
 
-        results = await search_provider.search(query)
 
-        if redis_client:
-            redis_client.set(cache_key, json.dumps(results.model_dump_json()), ex=7200)
+async def perform_search(query: str) -> SearchResponse:
+    search_provider = get_search_provider()
+    provider_name = os.getenv("SEARCH_PROVIDER", "searxng")
 
-        return results
+    try:
+        start = time.perf_counter()
+        response, tier = await search_cache.get_or_fetch(
+            search_cache_key(provider_name, query),
+            lambda: search_provider.search(query),
+        )
+        if STAGE_METRICS_ENABLED:
+            SEARCH_DURATION.labels(provider_name, tier).observe(
+                time.perf_counter() - start
+            )
+        return response
+    except HTTPException:
+        raise
     except Exception:
         raise HTTPException(
             status_code=500, detail="There was an error while searching."
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import os
+from contextlib import aclosing
+from typing import AsyncIterator, Coroutine
+
+from dotenv import load_dotenv
+from fastapi import Request
+
+from backend.metrics import STREAMS_CANCELLED, TASKS_CANCELLED
+from backend.schemas import ChatResponseEvent, StreamEvent, TextChunkStream
+
+load_dotenv()
+
+
+# Text deltas are batched into one event for up to this long, 0 disables
+STREAM_COALESCE_MAX_DELAY_MS = float(os.getenv("STREAM_COALESCE_MAX_DELAY_MS", 30))
+# ...or until this many bytes of text are buffered
+STREAM_COALESCE_MAX_BYTES = int(os.getenv("STREAM_COALESCE_MAX_BYTES", 1024))
+# Seconds between checks for a disconnected client while streaming
+STREAM_DISCONNECT_CHECK_INTERVAL = float(
+    os.getenv("STREAM_DISCONNECT_CHECK_INTERVAL", 0.5)
+)
+
+# Text chunks are by far the most frequent event, so their JSON envelope is
+# built once and each token is spliced into it
+_text_chunk_template = ChatResponseEvent(
+    event=StreamEvent.TEXT_CHUNK, data=TextChunkStream(text="")
+).model_dump_json()
+assert _text_chunk_template.endswith('""}}')
+TEXT_CHUNK_PREFIX = _text_chunk_template[: -len('""}}')]
+TEXT_CHUNK_SUFFIX = "}}"
+
+
+def text_chunk_event(text: str) -> ChatResponseEvent:
+    """Build a text chunk event without re-validating its fields."""
+    return ChatResponseEvent.model_construct(
+        event=StreamEvent.TEXT_CHUNK,
+        data=TextChunkStream.model_construct(text=text),
+    )
+
+
+def serialize_event(event: ChatResponseEvent) -> str:
+    if event.event == StreamEvent.TEXT_CHUNK:
+        return (
+            TEXT_CHUNK_PREFIX
+            + json.dumps(event.data.text, ensure_ascii=False)
+            + TEXT_CHUNK_SUFFIX
+        )
+    return event.model_dump_json()
+
+
+async def coalesce_text_chunks(
+    events: AsyncIterator[ChatResponseEvent],
+    max_delay: float = STREAM_COALESCE_MAX_DELAY_MS / 1000,
+    max_bytes: int = STREAM_COALESCE_MAX_BYTES,
+) -> AsyncIterator[ChatResponseEvent]:
+    """Merge consecutive text chunks into fewer, larger events.
+
+    Text is sent at most every `max_delay` seconds, or once `max_bytes` are
+    buffered, and always before any other event, so the order of events and
+    the full text are unchanged. The first text after a pause goes out at
+    once. Buffered text is only checked when the next event arrives, so it can
+    wait for up to one gap between tokens.
+    """
+    if max_delay <= 0:
+        async for event in events:
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    buffer: list[str] = []
+    buffered_bytes = 0
+    last_sent = float("-inf")
+
+    # Closed with the stream, so an abandoned stream stops its source too
+    async with aclosing(events):
+        async for event in events:
+            if event.event != StreamEvent.TEXT_CHUNK:
+                if buffer:
+                    yield text_chunk_event("".join(buffer))
+                    buffer, buffered_bytes = [], 0
+                yield event
+                continue
+
+            buffer.append(event.data.text)
+            buffered_bytes += len(event.data.text.encode())
+            now = loop.time()
+            if buffered_bytes >= max_bytes or now - last_sent >= max_delay:
+                yield text_chunk_event("".join(buffer))
+                buffer, buffered_bytes, last_sent = [], 0, now
+
+        if buffer:
+            yield text_chunk_event("".join(buffer))
+
+
+class TaskScope:
+    """Background tasks of one request, cancelled if the request ends first.
+
+    Unlike `asyncio.TaskGroup` this can be held open across `yield`s in a
+    stream generator, and closing the generator cancels the tasks.
+    """
+
+    def __init__(self):
+        self.tasks: set[asyncio.Task] = set()
+
+    def create_task(self, coro: Coroutine, *, name: str) -> asyncio.Task:
+        task = asyncio.create_task(coro, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def __aenter__(self) -> "TaskScope":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.aclose()
+
+    async def aclose(self) -> None:
+        pending = [task for task in self.tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+            TASKS_CANCELLED.labels(task.get_name()).inc()
+        if pending:
+            await asyncio.wait(pending)
+
+
+_STREAM_DONE = object()
+
+
+async def watch_for_disconnect(
+    request: Request, producer: asyncio.Task, interval: float
+) -> None:
+    while not producer.done():
+        if await request.is_disconnected():
+            producer.cancel()
+            return
+        await asyncio.sleep(interval)
+
+
+async def cancel_on_disconnect(
+    request: Request,
+    events: AsyncIterator[ChatResponseEvent],
+    interval: float = STREAM_DISCONNECT_CHECK_INTERVAL,
+) -> AsyncIterator[ChatResponseEvent]:
+    """Stream `events`, cancelling the work behind them once nobody listens.
+
+    Events are produced in their own task. A watcher cancels it as soon as the
+    client disconnects, and so does closing this generator, so the LLM stream,
+    searches and other upstream tasks never outlive the response.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for event in events:
+                queue.put_nowait(event)
+        except asyncio.CancelledError:
+            STREAMS_CANCELLED.inc()
+            raise
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(_STREAM_DONE)
+
+    producer = asyncio.create_task(produce())
+    watcher = asyncio.create_task(watch_for_disconnect(request, producer, interval))
+    try:
+        while (item := await queue.get()) is not _STREAM_DONE:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        watcher.cancel()
+        producer.cancel()
+        await asyncio.wait({watcher, producer})
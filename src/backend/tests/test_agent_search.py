@@ -0,0 +1,77 @@
+import asyncio
+
+from backend import agent_search
+from backend.agent_search import (
+    QueryPlanStep,
+    prepare_query_plan,
+    renumber_query_plan,
+    schedule_query_plan,
+    stream_pro_search_objects,
+)
+from backend.benchmarks.fakes import FakeLLM, FakeSearchProvider
+from backend.schemas import ChatRequest, StreamEvent
+from backend.search import search_service
+
+
+def plan(*steps: tuple[int, list[int]]) -> list[QueryPlanStep]:
+    return [
+        QueryPlanStep(id=id, step=f"step {position}", dependencies=dependencies)
+        for position, (id, dependencies) in enumerate(steps)
+    ]
+
+
+def test_duplicate_step_ids_are_renumbered():
+    steps = renumber_query_plan(plan((0, []), (1, [0]), (1, [1]), (2, [1, 7])))
+
+    assert [step.id for step in steps] == [0, 1, 2, 3]
+    assert [step.step for step in steps] == [f"step {i}" for i in range(4)]
+    # A repeated id resolves to the latest step with that id before the dependent
+    assert [step.dependencies for step in steps] == [[], [0], [1], [2]]
+
+
+def test_duplicate_step_ids_keep_every_step_scheduled():
+    *search_steps, _ = renumber_query_plan(plan((1, []), (1, []), (2, [1]), (3, [2])))
+
+    assert schedule_query_plan(search_steps) == {0: [], 1: [], 2: [1]}
+
+
+def test_one_step_plan_searches_the_question():
+    steps = prepare_query_plan("question", plan((0, [])))
+
+    assert [(step.id, step.step) for step in steps] == [(0, "question"), (1, "step 0")]
+    assert steps[-1].dependencies == [0]
+
+
+def test_answer_without_dependencies_uses_every_search_step():
+    steps = prepare_query_plan("question", plan((0, []), (1, []), (2, [2])))
+
+    assert steps[-1].dependencies == [0, 1]
+
+
+def test_one_step_plan_answers_from_search_results(monkeypatch):
+    async def save_turn(**turn):
+        return None
+
+    monkeypatch.setenv("SEARCH_PROVIDER", "test")
+    monkeypatch.setitem(
+        search_service.search_providers,
+        "test",
+        FakeSearchProvider(latency=0, num_results=3, content_size=50),
+    )
+    monkeypatch.setattr(agent_search, "save_turn", save_turn)
+    llm = FakeLLM(ttft=0, tokens_per_second=1000, answer_tokens=5, plan_steps=1)
+
+    async def main():
+        request = ChatRequest(query="one step question", pro_search=True)
+        return [
+            event
+            async for event in stream_pro_search_objects(
+                request, llm, request.query, session=None
+            )
+        ]
+
+    events = asyncio.run(main())
+    (search_results,) = [
+        event.data for event in events if event.event == StreamEvent.SEARCH_RESULTS
+    ]
+    assert search_results.results
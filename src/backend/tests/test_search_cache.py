@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+
+from backend.schemas import SearchResponse
+from backend.search.cache import CachedSearchResponse, SearchCache
+
+
+class SlowFetch:
+    """A provider call that runs until it is cancelled or released."""
+
+    def __init__(self):
+        self.calls = 0
+        self.started = asyncio.Event()
+        self.cancelled = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def __call__(self) -> SearchResponse:
+        self.calls += 1
+        self.started.set()
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled.set()
+            raise
+        return SearchResponse(images=["image"])
+
+
+class FakeRedis:
+    def __init__(self, payloads: dict[str, str]):
+        self.payloads = payloads
+
+    async def get(self, key: str) -> str | None:
+        return self.payloads.get(key)
+
+    async def set(self, key: str, payload: str, ex: int) -> None:
+        self.payloads[key] = payload
+
+
+def cached_payload(age: float) -> str:
+    return CachedSearchResponse(
+        fetched_at=time.time() - age, response=SearchResponse(images=["cached"])
+    ).model_dump_json()
+
+
+def test_entries_from_redis_expire_in_memory_by_fetch_time():
+    async def main():
+        cache = SearchCache(FakeRedis({"key": cached_payload(age=99)}), ttl=100)
+
+        response, tier = await cache.get_or_fetch("key", SlowFetch())
+        assert (response.images, tier) == (["cached"], "redis")
+        expires_at, _, _ = cache.local_cache.entries["key"]
+        assert expires_at - time.monotonic() == pytest.approx(1, abs=0.1)
+
+    asyncio.run(main())
+
+
+def test_entries_past_ttl_are_not_served_without_stale_ttl():
+    async def main():
+        cache = SearchCache(FakeRedis({"key": cached_payload(age=101)}), ttl=100)
+        fetch = SlowFetch()
+        fetch.release.set()
+
+        response, tier = await cache.get_or_fetch("key", fetch)
+        assert (response.images, tier) == (["image"], "provider")
+        assert not cache.refreshes
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_cancels_provider_call():
+    async def main():
+        cache = SearchCache(redis_client=None)
+        fetch = SlowFetch()
+
+        caller = asyncio.create_task(cache.get_or_fetch("key", fetch))
+        await fetch.started.wait()
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+
+        await asyncio.wait_for(fetch.cancelled.wait(), timeout=1)
+        await asyncio.sleep(0)
+        assert cache.in_flight == {}
+        assert cache.waiters == {}
+
+    asyncio.run(main())
+
+
+def test_provider_call_continues_while_another_caller_waits():
+    async def main():
+        cache = SearchCache(redis_client=None)
+        fetch = SlowFetch()
+
+        first = asyncio.create_task(cache.get_or_fetch("key", fetch))
+        second = asyncio.create_task(cache.get_or_fetch("key", fetch))
+        await fetch.started.wait()
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+        fetch.release.set()
+        response, tier = await second
+        assert response.images == ["image"]
+        assert tier == "provider"
+        assert fetch.calls == 1
+        assert not fetch.cancelled.is_set()
+
+    asyncio.run(main())
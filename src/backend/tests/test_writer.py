@@ -0,0 +1,61 @@
+import asyncio
+
+from backend.db import writer
+from backend.db.writer import TurnWriter
+from backend.metrics import DB_TURN_WRITES
+
+
+def turn_writes(result: str) -> float:
+    return DB_TURN_WRITES.labels(result)._value.get()
+
+
+def submit(turn_writer: TurnWriter, thread_id: int):
+    return turn_writer.submit(
+        session=None,
+        thread_id=thread_id,
+        user_message="question",
+        assistant_message="answer",
+        model="model",
+    )
+
+
+def test_reads_wait_for_queued_turns_of_their_thread(monkeypatch):
+    written = []
+
+    async def write_turn(turn):
+        await asyncio.sleep(0.01)
+        written.append(turn.thread_id)
+
+    monkeypatch.setattr(writer, "write_turn", write_turn)
+
+    async def main():
+        turn_writer = TurnWriter(max_queue_size=10, max_retries=0)
+        turn_writer.start()
+        await submit(turn_writer, 1)
+        await submit(turn_writer, 2)
+        await turn_writer.wait_for_thread(1)
+        assert written == [1]
+        await turn_writer.stop()
+
+    before = turn_writes("written")
+    asyncio.run(main())
+    assert turn_writes("written") - before == 2
+
+
+def test_failed_turns_are_counted(monkeypatch):
+    async def write_turn(turn):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(writer, "write_turn", write_turn)
+
+    async def main():
+        turn_writer = TurnWriter(max_queue_size=10, max_retries=1)
+        turn_writer.start()
+        await submit(turn_writer, 1)
+        await turn_writer.stop()
+        assert not turn_writer.pending
+
+    failed, retried = turn_writes("failed"), turn_writes("retried")
+    asyncio.run(main())
+    assert turn_writes("failed") - failed == 1
+    assert turn_writes("retried") - retried == 1
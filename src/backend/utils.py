@@ -1,4 +1,5 @@
 import os
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 from backend.constants import ChatModel
 
@@ -20,5 +21,36 @@ def strtobool(val: str | bool) -> bool:
     return val.lower() in ("true", "1", "t")
 
 
+TRACKING_QUERY_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref", "ref_src"}
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize a URL so the same page is stored and ranked once.
+
+    Lowercases the scheme and host, drops default ports, fragments, trailing
+    slashes and tracking parameters, and sorts the remaining query parameters.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url.strip()
+
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if port and (scheme, port) not in (("http", 80), ("https", 443)):
+        netloc = f"{netloc}:{port}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.lower().startswith("utm_")
+            and key.lower() not in TRACKING_QUERY_PARAMS
+        )
+    )
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
 DB_ENABLED = strtobool(os.environ.get("DB_ENABLED", "true"))
 PRO_MODE_ENABLED = strtobool(os.environ.get("PRO_MODE_ENABLED", "true"))
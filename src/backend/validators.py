@@ -1,6 +1,6 @@
 import os
 
-from backend.constants import ChatModel
+from backend.constants import ChatModel, ModelStage, stage_models
 from backend.utils import is_local_model, strtobool
 
 
@@ -27,3 +27,24 @@ def validate_model(model: ChatModel):
     else:
         raise ValueError("Invalid model")
     return True
+
+
+def get_stage_model(stage: ModelStage, model: ChatModel) -> ChatModel:
+    """Model to run an auxiliary stage on, for a request made with `model`.
+
+    Falls back to the request's model when the stage model is unusable, and
+    never routes a request made with a local model to a hosted one.
+    """
+    stage_model = stage_models[stage]
+    if stage_model is None or stage_model == model:
+        return model
+    if is_local_model(model) and not is_local_model(stage_model):
+        return model
+    try:
+        validate_model(stage_model)
+    except ValueError as e:
+        print(
+            f"Using {model.value} for {stage.value}, {stage_model.value} is unavailable: {e}"
+        )
+        return model
+    return stage_model
@@ -204,6 +204,17 @@ export const $ChatHistoryResponse = {
       type: "array",
       title: "Snapshots",
     },
+    next_cursor: {
+      anyOf: [
+        {
+          type: "string",
+        },
+        {
+          type: "null",
+        },
+      ],
+      title: "Next Cursor",
+    },
   },
   type: "object",
   title: "ChatHistoryResponse",
@@ -10,7 +10,16 @@ import { useQueryClient } from "@tanstack/react-query"
 
 export default function RecentsPage() {
   const queryClient = useQueryClient()
-  const { data: chats, isLoading, error, refetch, isRefetching } = useChatHistory()
+  const {
+    data: chats,
+    isLoading,
+    error,
+    refetch,
+    isRefetching,
+    fetchNextPage,
+    hasNextPage,
+    isFetchingNextPage,
+  } = useChatHistory()
 
   const handleRefresh = () => {
     refetch()
@@ -85,6 +94,17 @@ export default function RecentsPage() {
                 {index < chats.length - 1 && <Separator className="" />}
               </React.Fragment>
             ))}
+            {hasNextPage && (
+              <Button
+                variant="outline"
+                size="sm"
+                onClick={() => fetchNextPage()}
+                disabled={isFetchingNextPage}
+                className="self-center"
+              >
+                {isFetchingNextPage ? "Loading..." : "Load more"}
+              </Button>
+            )}
           </ul>
         ) : chats && chats.length === 0 && !error ? (
           <div className="text-center py-10">
@@ -26,7 +26,16 @@ const scrollbarHideStyles = `
 export function Sidebar() {
   const pathname = usePathname()
   const router = useRouter()
-  const { data: chats, isLoading, error, refetch, isRefetching } = useChatHistory()
+  const {
+    data: chats,
+    isLoading,
+    error,
+    refetch,
+    isRefetching,
+    fetchNextPage,
+    hasNextPage,
+    isFetchingNextPage,
+  } = useChatHistory()
   const { messages, setMessages, setThreadId } = useChatStore()
 
   const handleNewChat = () => {
@@ -135,6 +144,17 @@ export function Sidebar() {
               ) : (
                 <div className="text-xs text-muted-foreground p-2">No chat history yet</div>
               )}
+              {hasNextPage && (
+                <Button
+                  variant="ghost"
+                  size="sm"
+                  className="w-full h-7 text-xs text-muted-foreground"
+                  onClick={() => fetchNextPage()}
+                  disabled={isFetchingNextPage}
+                >
+                  {isFetchingNextPage ? "Loading..." : "Load more"}
+                </Button>
+              )}
             </div>
           )}
         </div>
@@ -1,11 +1,20 @@
-import { useQuery } from "@tanstack/react-query"
+import { type InfiniteData, useInfiniteQuery } from "@tanstack/react-query"
 import { env } from "@/env"
-import type { ChatSnapshot } from "../../generated/types.gen"
+import type { ChatHistoryResponse, ChatSnapshot } from "../../generated/types.gen"
 
 const BASE_URL = env.NEXT_PUBLIC_API_URL
 
+// Threads per page, older pages are only fetched when asked for
+const HISTORY_PAGE_SIZE = 20
+
 // Implement a more robust fetch function with XMLHttpRequest fallback
-export const fetchChatHistory = async (): Promise<ChatSnapshot[]> => {
+const fetchChatHistoryPage = async (cursor: string | null): Promise<ChatHistoryResponse> => {
+  const params = new URLSearchParams({ limit: String(HISTORY_PAGE_SIZE) })
+  if (cursor) {
+    params.set("cursor", cursor)
+  }
+  const pageUrl = `${BASE_URL}/history?${params}`
+
   // First try with fetch API
   const fetchWithTimeout = async (url: string, options: RequestInit, timeout = 10000): Promise<Response> => {
     const controller = new AbortController()
@@ -25,8 +34,8 @@ export const fetchChatHistory = async (): Promise<ChatSnapshot[]> => {
 
   // Try with fetch first
   try {
-    console.log(`Fetching chat history from ${BASE_URL}/history`)
-    const response = await fetchWithTimeout(`${BASE_URL}/history`, {
+    console.log(`Fetching chat history from ${pageUrl}`)
+    const response = await fetchWithTimeout(pageUrl, {
       method: "GET",
       headers: {
         "Content-Type": "application/json",
@@ -43,8 +52,7 @@ export const fetchChatHistory = async (): Promise<ChatSnapshot[]> => {
       throw new Error(`HTTP error! Status: ${response.status}`)
     }
 
-    const data = await response.json()
-    return data.snapshots || []
+    return await response.json()
   } catch (fetchError) {
     console.warn("Fetch API failed, falling back to XMLHttpRequest:", fetchError)
 
@@ -56,8 +64,7 @@ export const fetchChatHistory = async (): Promise<ChatSnapshot[]> => {
         if (xhr.readyState === 4) {
           if (xhr.status >= 200 && xhr.status < 300) {
             try {
-              const data = JSON.parse(xhr.responseText)
-              resolve(data.snapshots || [])
+              resolve(JSON.parse(xhr.responseText))
             } catch (parseError) {
               console.error("Error parsing JSON response:", parseError)
               reject(new Error("Failed to parse server response"))
@@ -81,7 +88,7 @@ export const fetchChatHistory = async (): Promise<ChatSnapshot[]> => {
       }
 
       // Open and send request
-      xhr.open("GET", `${BASE_URL}/history`, true)
+      xhr.open("GET", pageUrl, true)
       xhr.timeout = 15000 // 15 seconds timeout
 
       // Set headers
@@ -98,11 +105,17 @@ export const fetchChatHistory = async (): Promise<ChatSnapshot[]> => {
 
 // Update the useChatHistory hook with better error handling and retry logic
 export const useChatHistory = () => {
-  return useQuery<ChatSnapshot[], Error>({
+  return useInfiniteQuery<
+    ChatHistoryResponse,
+    Error,
+    ChatSnapshot[],
+    string[],
+    string | null
+  >({
     queryKey: ["chatHistory"],
-    queryFn: async () => {
+    queryFn: async ({ pageParam }) => {
       try {
-        return await fetchChatHistory()
+        return await fetchChatHistoryPage(pageParam)
       } catch (error) {
         console.error("Error in useChatHistory:", error)
         // Rethrow with a more user-friendly message
@@ -113,10 +126,14 @@ export const useChatHistory = () => {
         )
       }
     },
+    initialPageParam: null,
+    getNextPageParam: (lastPage) => lastPage.next_cursor ?? null,
+    // The loaded pages as one list, newest thread first
+    select: (data: InfiniteData<ChatHistoryResponse, string | null>) =>
+      data.pages.flatMap((page) => page.snapshots || []),
     retry: 3,
     retryDelay: (attempt) => Math.min(1000 * 2 ** attempt, 30000), // Exponential backoff
     staleTime: 30 * 1000, // Reduced to 30 seconds from 5 minutes
     refetchOnWindowFocus: true, // Refresh when window regains focus
   })
 }
-